@@ -1,13 +1,66 @@
-from fastapi import APIRouter, Query
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Query, Request
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from sqlalchemy import text
 from app.core.database import AsyncSessionLocal
+from app.core.cache import cached
 
 router = APIRouter()
 
+# Static query text: the bucket size is a bind parameter so Postgres can reuse
+# the plan. Counts come from the per-minute rollup (re-bucketed for hour/day),
+# labels are pivoted server-side and a generate_series of buckets is LEFT
+# JOINed in, so the response is dense (empty buckets come back as zeros).
+AGGREGATE_QUERY = text("""
+    WITH buckets AS (
+        SELECT generate_series(
+            date_trunc(:period, CAST(:start_date AS timestamp)),
+            date_trunc(:period, CAST(:end_date AS timestamp)),
+            CAST('1 ' || :period AS interval)
+        ) AS ts
+    ),
+    agg AS (
+        SELECT
+            date_trunc(:period, ts) AS ts,
+            SUM(count) FILTER (WHERE label = 'positive') AS positive_count,
+            SUM(count) FILTER (WHERE label = 'negative') AS negative_count,
+            SUM(count) FILTER (WHERE label = 'neutral') AS neutral_count,
+            SUM(count) AS total_count,
+            SUM(sum_conf) / NULLIF(SUM(count), 0) AS average_confidence
+        FROM sentiment_rollup_minute
+        WHERE ts >= date_trunc('minute', CAST(:start_date AS timestamp))
+          AND ts <= :end_date
+        GROUP BY 1
+    )
+    SELECT
+        b.ts AS timestamp,
+        COALESCE(a.positive_count, 0) AS positive_count,
+        COALESCE(a.negative_count, 0) AS negative_count,
+        COALESCE(a.neutral_count, 0) AS neutral_count,
+        COALESCE(a.total_count, 0) AS total_count,
+        a.average_confidence
+    FROM buckets b
+    LEFT JOIN agg a ON a.ts = b.ts
+    ORDER BY b.ts ASC
+""")
+
+# Most buckets one response may hold; every bucket is generated, encoded and
+# cached, so e.g. minute buckets over years are rejected up front
+MAX_AGGREGATE_BUCKETS = 10_000
+PERIOD_LENGTH = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+def _as_naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+# Cache TTL per bucket size: finer buckets go stale sooner
+AGGREGATE_TTL_SECONDS = {"minute": 15, "hour": 60, "day": 300}
+
 @router.get("/sentiment/aggregate")
+@cached(ttl_seconds=lambda request: AGGREGATE_TTL_SECONDS.get(
+    request.query_params.get("period", "hour"), 60
+))
 async def get_sentiment_aggregate(
+    request: Request,
     period: str = Query("hour", regex="^(minute|hour|day)$"),
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None
@@ -17,110 +70,42 @@ async def get_sentiment_aggregate(
     if not start_date:
         start_date = end_date - timedelta(hours=24)
     
-    if period == "minute":
-        trunc_func = "date_trunc('minute', analyzed_at)"
-    elif period == "hour":
-        trunc_func = "date_trunc('hour', analyzed_at)"
-    else:  # day
-        trunc_func = "date_trunc('day', analyzed_at)"
+    span = _as_naive_utc(end_date) - _as_naive_utc(start_date)
+    if span / PERIOD_LENGTH[period] > MAX_AGGREGATE_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range spans more than {MAX_AGGREGATE_BUCKETS} {period} buckets; use a larger period or a shorter range"
+        )
     
     async with AsyncSessionLocal() as session:
-        query = f"""
-        SELECT 
-            {trunc_func} as timestamp,
-            sentiment_label,
-            COUNT(*) as count,
-            AVG(confidence_score) as avg_confidence
-        FROM sentiment_analysis
-        WHERE analyzed_at >= :start_date AND analyzed_at <= :end_date
-        GROUP BY timestamp, sentiment_label
-        ORDER BY timestamp ASC
-        """
-        
         rows = (await session.execute(
-            text(query),
-            {'start_date': start_date, 'end_date': end_date}
+            AGGREGATE_QUERY,
+            {'period': period, 'start_date': start_date, 'end_date': end_date}
         )).all()
     
-    data_dict = {}
-    for row in rows:
-        ts = row.timestamp.isoformat()
-        if ts not in data_dict:
-            data_dict[ts] = {
-                'timestamp': ts,
-                'positive_count': 0,
-                'negative_count': 0,
-                'neutral_count': 0,
-                'total_count': 0,
-                'average_confidence': []
-            }
-        
-        label = row.sentiment_label
-        count = row.count
-        
-        if label == 'positive':
-            data_dict[ts]['positive_count'] = count
-        elif label == 'negative':
-            data_dict[ts]['negative_count'] = count
-        elif label == 'neutral':
-            data_dict[ts]['neutral_count'] = count
-            
-        data_dict[ts]['total_count'] += count
-        if row.avg_confidence:
-            data_dict[ts]['average_confidence'].append(row.avg_confidence)
-    
-    final_data = []
-    total_positive = 0
-    total_negative = 0
-    total_neutral = 0
-    
-    sorted_ts = sorted(data_dict.keys())
+    final_data = [
+        {
+            'timestamp': row.timestamp,  # ORJSONResponse emits ISO-8601
+            'positive_count': row.positive_count,
+            'negative_count': row.negative_count,
+            'neutral_count': row.neutral_count,
+            'total_count': row.total_count,
+            'positive_percentage': (row.positive_count / row.total_count * 100) if row.total_count else 0.0,
+            'negative_percentage': (row.negative_count / row.total_count * 100) if row.total_count else 0.0,
+            'neutral_percentage': (row.neutral_count / row.total_count * 100) if row.total_count else 0.0,
+            'average_confidence': float(row.average_confidence or 0.0)
+        }
+        for row in rows
+    ]
     
-    for ts in sorted_ts:
-        d = data_dict[ts]
-        total = d['total_count']
-        
-        d['positive_percentage'] = (d['positive_count'] / total * 100) if total else 0.0
-        d['negative_percentage'] = (d['negative_count'] / total * 100) if total else 0.0
-        d['neutral_percentage'] = (d['neutral_count'] / total * 100) if total else 0.0
-        
-        if d['average_confidence']:
-            d['average_confidence'] = sum(d['average_confidence']) / len(d['average_confidence'])
-        else:
-            d['average_confidence'] = 0.0
-            
-        total_positive += d['positive_count']
-        total_negative += d['negative_count']
-        total_neutral += d['neutral_count']
-        
-        final_data.append(d)
-        
-    # CRITICAL: Ensure at least one time period is returned even if no data
-    if not final_data:
-        # Generate a single time period with zero counts
-        if period == 'minute':
-            base_time = end_date.replace(second=0, microsecond=0)
-        elif period == 'hour':
-            base_time = end_date.replace(minute=0, second=0, microsecond=0)
-        else:  # day
-            base_time = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        final_data = [{
-            'timestamp': base_time.isoformat(),
-            'positive_count': 0,
-            'negative_count': 0,
-            'neutral_count': 0,
-            'total_count': 0,
-            'positive_percentage': 0.0,
-            'negative_percentage': 0.0,
-            'neutral_percentage': 0.0,
-            'average_confidence': 0.0
-        }]
+    total_positive = sum(d['positive_count'] for d in final_data)
+    total_negative = sum(d['negative_count'] for d in final_data)
+    total_neutral = sum(d['neutral_count'] for d in final_data)
     
     return {
         "period": period,
-        "start_date": start_date.isoformat(),
-        "end_date": end_date.isoformat(),
+        "start_date": start_date,
+        "end_date": end_date,
         "data": final_data,
         "summary": {
             "total_posts": total_positive + total_negative + total_neutral,
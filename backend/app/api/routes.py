@@ -1,50 +1,40 @@
 from app.api.aggregate import router as aggregate_router
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
 from datetime import datetime
 from typing import Optional
 from sqlalchemy import text
-from app.core.database import AsyncSessionLocal
-import redis
-import os
-import json
+from app.core.database import AsyncSessionLocal, estimated_count_sql, fast_row_count
+from app.core.cache import cached
+import orjson
 
 router = APIRouter(prefix="/api")
 router.include_router(aggregate_router)
 
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-
-def get_redis():
-    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
-
 @router.get("/health")
-async def health_check():
+@cached(ttl_seconds=5)
+async def health_check(request: Request):
     try:
         async with AsyncSessionLocal() as session:
-            await session.execute(text("SELECT 1"))
+            # One round-trip for connectivity + all stats
+            stats = (await session.execute(text(f"""
+                SELECT
+                    {estimated_count_sql("social_media_posts")} AS total_posts,
+                    {estimated_count_sql("sentiment_analysis")} AS total_analyses,
+                    (SELECT COUNT(*) FROM social_media_posts
+                     WHERE ingested_at >= NOW() - INTERVAL '1 hour') AS recent_posts_1h
+            """))).first()
             db_status = "connected"
 
-            total_posts = (await session.execute(
-                text("SELECT COUNT(*) FROM social_media_posts")
-            )).scalar()
-
-            total_analyses = (await session.execute(
-                text("SELECT COUNT(*) FROM sentiment_analysis")
-            )).scalar()
-
-            recent_posts_1h = (await session.execute(
-                text("""
-                SELECT COUNT(*) FROM social_media_posts
-                WHERE ingested_at >= NOW() - INTERVAL '1 hour'
-                """)
-            )).scalar()
+            total_posts = stats.total_posts
+            total_analyses = stats.total_analyses
+            recent_posts_1h = stats.recent_posts_1h
     except Exception:
         db_status = "disconnected"
         total_posts = total_analyses = recent_posts_1h = 0
 
     try:
-        r = get_redis()
-        r.ping()
+        await request.app.state.redis.ping()
         redis_status = "connected"
     except Exception:
         redis_status = "disconnected"
@@ -56,7 +46,7 @@ async def health_check():
 
     return {
         "status": overall_status,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.utcnow(),
         "services": {"database": db_status, "redis": redis_status},
         "stats": {
             "total_posts": total_posts,
@@ -74,84 +64,92 @@ async def get_posts(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
 ):
-    async with AsyncSessionLocal() as session:
-        # Build query filters
-        filters = []
-        params = {"limit": limit, "offset": offset}
+    # Build query filters
+    filters = []
+    params = {"limit": limit, "offset": offset}
+    
+    if source:
+        filters.append("p.source = :source")
+        params["source"] = source
         
-        if source:
-            filters.append("p.source = :source")
-            params["source"] = source
-            
-        if sentiment:
-            filters.append("a.sentiment_label = :sentiment")
-            params["sentiment"] = sentiment
-            
-        if start_date:
-            filters.append("p.created_at >= :start_date")
-            params["start_date"] = start_date
+    if sentiment:
+        filters.append("a.sentiment_label = :sentiment")
+        params["sentiment"] = sentiment
         
-        if end_date:
-            filters.append("p.created_at <= :end_date")
-            params["end_date"] = end_date
-            
-        where_clause = "WHERE " + " AND ".join(filters) if filters else ""
+    if start_date:
+        filters.append("p.created_at >= :start_date")
+        params["start_date"] = start_date
+    
+    if end_date:
+        filters.append("p.created_at <= :end_date")
+        params["end_date"] = end_date
         
-        # Get Posts
-        query = f"""
-            SELECT
-              p.post_id, p.source, p.content, p.author, p.created_at,
-              a.sentiment_label, a.confidence_score, a.emotion, a.model_name
-            FROM social_media_posts p
-            JOIN sentiment_analysis a ON a.post_id = p.post_id
-            {where_clause}
-            ORDER BY p.created_at DESC
-            LIMIT :limit OFFSET :offset
-            """
-            
-        rows = (await session.execute(text(query), params)).mappings().all()
-
-        # Get Total Count
-        count_query = f"""
-            SELECT COUNT(*) 
-            FROM social_media_posts p
-            JOIN sentiment_analysis a ON a.post_id = p.post_id
-            {where_clause}
+    where_clause = "WHERE " + " AND ".join(filters) if filters else ""
+    # Filtered totals ride along as a window count in the same query;
+    # unfiltered totals use the planner estimate so LIMIT stays cheap
+    total_column = ", COUNT(*) OVER () AS total" if filters else ""
+    
+    query = f"""
+        SELECT
+          p.post_id, p.source, p.content, p.author, p.created_at,
+          a.sentiment_label, a.confidence_score, a.emotion, a.model_name
+          {total_column}
+        FROM social_media_posts p
+        JOIN sentiment_analysis a ON a.post_id = p.post_id
+        {where_clause}
+        ORDER BY p.created_at DESC
+        LIMIT :limit OFFSET :offset
         """
-        total = (await session.execute(text(count_query), params)).scalar()
 
-    return {
-        "posts": [
-            {
-                "post_id": r["post_id"],
-                "source": r["source"],
-                "content": r["content"],
-                "author": r["author"],
-                "created_at": r["created_at"],
-                "sentiment": {
-                    "label": r["sentiment_label"],
-                    "confidence": r["confidence_score"],
-                    "emotion": r["emotion"],
-                    "model_name": r["model_name"],
-                },
-            }
-            for r in rows
-        ],
-        "total": total,
-        "limit": limit,
-        "offset": offset,
-    }
+    async def stream_posts():
+        # Rows are read through a server-side cursor and encoded one at a
+        # time, so memory stays flat regardless of `limit` / content size
+        async with AsyncSessionLocal() as session:
+            # Planner estimate when unfiltered: every analysis row joins
+            # exactly one post
+            total = None if filters else await fast_row_count(session, "sentiment_analysis")
+
+            yield b'{"posts":['
+            separator = b""
+            result = await session.stream(text(query), params)
+            async for r in result.mappings():
+                if total is None:
+                    total = r["total"]
+                yield separator + orjson.dumps({
+                    "post_id": r["post_id"],
+                    "source": r["source"],
+                    "content": r["content"],
+                    "author": r["author"],
+                    "created_at": r["created_at"],
+                    "sentiment": {
+                        "label": r["sentiment_label"],
+                        "confidence": r["confidence_score"],
+                        "emotion": r["emotion"],
+                        "model_name": r["model_name"],
+                    },
+                })
+                separator = b","
+
+            yield b'],' + orjson.dumps({
+                "total": total or 0,
+                "limit": limit,
+                "offset": offset,
+            })[1:]
+
+    return StreamingResponse(stream_posts(), media_type="application/json")
 
 @router.get("/sentiment/distribution")
-async def sentiment_distribution(hours: int = Query(24, ge=1, le=168)):
+@cached(ttl_seconds=60)
+async def sentiment_distribution(request: Request, hours: int = Query(24, ge=1, le=168)):
     async with AsyncSessionLocal() as session:
         rows = (await session.execute(
-            text(f"""
-            SELECT sentiment_label, COUNT(*)
-            FROM sentiment_analysis
-            WHERE analyzed_at >= NOW() - INTERVAL '{hours} hours'
-            GROUP BY sentiment_label
-            """)
+            text("""
+            SELECT label, SUM(count)
+            FROM sentiment_rollup_minute
+            WHERE ts >= date_trunc('minute', NOW() - make_interval(hours => :hours))
+            GROUP BY label
+            """),
+            {"hours": hours}
         )).all()
 
     distribution = {"positive": 0, "negative": 0, "neutral": 0}
@@ -170,21 +168,6 @@ async def sentiment_distribution(hours: int = Query(24, ge=1, le=168)):
         },
     }
 
-@router.post("/internal/broadcast")
-async def internal_broadcast(post_data: dict):
-    """
-    Internal endpoint for worker to broadcast new analyzed posts to WebSocket clients.
-    This is called by the worker service after saving analysis results.
-    """
-    try:
-        from app.api.websocket import broadcast_new_post
-        await broadcast_new_post(post_data)
-        return {"status": "ok", "broadcasted": post_data['post_id']}
-    except Exception as e:
-        # Logger is not defined here, using print for now or we should import logger
-        print(f"Broadcast error: {e}")
-        return {"status": "error", "message": str(e)}
-
 @router.get("/alerts")
 async def get_alerts(
     limit: int = Query(50, ge=1, le=100),
@@ -205,12 +188,14 @@ async def get_alerts(
             params["alert_type"] = alert_type
         
         where_clause = "WHERE " + " AND ".join(filters) if filters else ""
+        total_column = ", COUNT(*) OVER () AS total" if filters else ""
         
         # Get alerts
         query = f"""
             SELECT 
                 id, alert_type, threshold_value, actual_value,
                 window_start, window_end, post_count, triggered_at, details
+                {total_column}
             FROM sentiment_alerts
             {where_clause}
             ORDER BY triggered_at DESC
@@ -220,8 +205,10 @@ async def get_alerts(
         rows = (await session.execute(text(query), params)).mappings().all()
         
         # Get total count
-        count_query = f"SELECT COUNT(*) FROM sentiment_alerts {where_clause}"
-        total = (await session.execute(text(count_query), params)).scalar()
+        if filters:
+            total = rows[0]["total"] if rows else 0
+        else:
+            total = await fast_row_count(session, "sentiment_alerts")
     
     return {
         "alerts": [
@@ -244,61 +231,61 @@ async def get_alerts(
     }
 
 @router.get("/metrics")
-async def get_metrics():
+@cached(ttl_seconds=15)
+async def get_metrics(request: Request):
     """
     System metrics for monitoring and observability.
     """
     async with AsyncSessionLocal() as session:
-        # Total counts
-        total_posts = (await session.execute(
-            text("SELECT COUNT(*) FROM social_media_posts")
-        )).scalar()
-        
-        total_analyses = (await session.execute(
-            text("SELECT COUNT(*) FROM sentiment_analysis")
-        )).scalar()
-        
-        total_alerts = (await session.execute(
-            text("SELECT COUNT(*) FROM sentiment_alerts")
-        )).scalar()
-        
-        # Processing metrics (last hour)
-        last_hour_stats = (await session.execute(text("""
-            SELECT 
-                COUNT(*) as total,
-                AVG(confidence_score) as avg_confidence,
-                COUNT(*) FILTER (WHERE sentiment_label = 'positive') as positive,
-                COUNT(*) FILTER (WHERE sentiment_label = 'negative') as negative,
-                COUNT(*) FILTER (WHERE sentiment_label = 'neutral') as neutral
-            FROM sentiment_analysis
-            WHERE analyzed_at >= NOW() - INTERVAL '1 hour'
+        # Totals, last-hour processing stats and model usage in one round-trip
+        stats = (await session.execute(text(f"""
+            SELECT
+                {estimated_count_sql("social_media_posts")} AS total_posts,
+                {estimated_count_sql("sentiment_analysis")} AS total_analyses,
+                {estimated_count_sql("sentiment_alerts")} AS total_alerts,
+                lh.total,
+                lh.avg_confidence,
+                lh.positive,
+                lh.negative,
+                lh.neutral,
+                (
+                    SELECT COALESCE(
+                        json_agg(json_build_object('name', model_name, 'usage_count', count)),
+                        '[]'::json
+                    )
+                    FROM (
+                        SELECT model_name, COUNT(*) AS count
+                        FROM sentiment_analysis
+                        GROUP BY model_name
+                    ) m
+                ) AS models
+            FROM (
+                SELECT 
+                    COALESCE(SUM(count), 0) as total,
+                    SUM(sum_conf) / NULLIF(SUM(count), 0) as avg_confidence,
+                    COALESCE(SUM(count) FILTER (WHERE label = 'positive'), 0) as positive,
+                    COALESCE(SUM(count) FILTER (WHERE label = 'negative'), 0) as negative,
+                    COALESCE(SUM(count) FILTER (WHERE label = 'neutral'), 0) as neutral
+                FROM sentiment_rollup_minute
+                WHERE ts >= date_trunc('minute', NOW() - INTERVAL '1 hour')
+            ) lh
         """))).first()
-        
-        # Model usage stats
-        model_usage = (await session.execute(text("""
-            SELECT model_name, COUNT(*) as count
-            FROM sentiment_analysis
-            GROUP BY model_name
-        """))).all()
     
     return {
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.utcnow(),
         "totals": {
-            "posts": total_posts,
-            "analyses": total_analyses,
-            "alerts": total_alerts
+            "posts": stats.total_posts,
+            "analyses": stats.total_analyses,
+            "alerts": stats.total_alerts
         },
         "last_hour": {
-            "total_processed": last_hour_stats.total,
-            "avg_confidence": float(last_hour_stats.avg_confidence or 0),
+            "total_processed": stats.total,
+            "avg_confidence": float(stats.avg_confidence or 0),
             "sentiment_breakdown": {
-                "positive": last_hour_stats.positive,
-                "negative": last_hour_stats.negative,
-                "neutral": last_hour_stats.neutral
+                "positive": stats.positive,
+                "negative": stats.negative,
+                "neutral": stats.neutral
             }
         },
-        "models": [
-            {"name": m.model_name, "usage_count": m.count}
-            for m in model_usage
-        ]
+        "models": stats.models
     }
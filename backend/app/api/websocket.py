@@ -1,131 +1,201 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List
+from typing import Dict, Iterable, Optional, Set
 import asyncio
-import json
+import orjson
 from datetime import datetime
+from redis.exceptions import RedisError
 from sqlalchemy import text
 from app.core.database import AsyncSessionLocal
 
+# Redis channels clients can pick from via /ws/sentiment?channels=negative,alerts.
+# The worker publishes each post to its class channel (see worker/worker.py),
+# AlertService publishes triggered alerts.
+CHANNELS = {
+    "positive": "events:sentiment:positive",
+    "negative": "events:sentiment:negative",
+    "neutral": "events:sentiment:neutral",
+    "alerts": "events:alerts",
+}
+# Keyed by the raw channel name as the (non-decoding) client delivers it
+CHANNEL_NAMES = {redis_channel.encode(): name for name, redis_channel in CHANNELS.items()}
+
+# Messages buffered per client before new ones are dropped for that client
+SEND_QUEUE_SIZE = 100
+
+# Idle seconds before every client is sent a ping frame; a dead peer fails
+# that send and is dropped instead of holding its socket indefinitely
+HEARTBEAT_SECONDS = 15
+
 class ConnectionManager:
+    """
+    Each connection gets a bounded send queue drained by its own writer
+    task, so broadcasting never waits on the network and a slow or dead
+    client cannot stall delivery to everyone else.
+    """
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
+        self.subscribers: Dict[str, Set[WebSocket]] = {name: set() for name in CHANNELS}
     
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, channels: Optional[Iterable[str]] = None):
+        """
+        Register a client for `channels` (names from CHANNELS, all by default).
+        """
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.active_connections[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
+        for name in channels if channels is not None else CHANNELS:
+            self.subscribers[name].add(websocket)
     
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        self.active_connections.pop(websocket, None)
+        for subscribers in self.subscribers.values():
+            subscribers.discard(websocket)
+        writer = self._writers.pop(websocket, None)
+        if writer and writer is not asyncio.current_task():
+            writer.cancel()
     
-    async def broadcast(self, message: dict):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(connection)
-        
-        for conn in disconnected:
-            if conn in self.active_connections:
-                self.active_connections.remove(conn)
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(websocket)
+    
+    def _enqueue(self, websocket: WebSocket, payload: str):
+        queue = self.active_connections.get(websocket)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            pass  # client is not keeping up, drop the message for it
+    
+    def send(self, websocket: WebSocket, message: dict):
+        self._enqueue(websocket, orjson.dumps(message).decode())
+    
+    async def broadcast(self, message: dict, channel: Optional[str] = None):
+        """
+        Send to every client, or only to those subscribed to `channel`.
+        """
+        # Serialize once, every client gets the same text frame
+        self.broadcast_payload(orjson.dumps(message).decode(), channel)
+    
+    def broadcast_payload(self, payload: str, channel: Optional[str] = None):
+        """
+        Like broadcast() for an already-encoded JSON frame.
+        """
+        targets = self.active_connections if channel is None else self.subscribers[channel]
+        for websocket in list(targets):
+            self._enqueue(websocket, payload)
 
 manager = ConnectionManager()
 
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    # Unknown names are ignored; no (valid) filter means every channel
+    requested = websocket.query_params.get("channels", "")
+    channels = [name for name in requested.split(",") if name in CHANNELS] or None
+    await manager.connect(websocket, channels)
     
-    await websocket.send_json({
+    manager.send(websocket, {
         "type": "connected",
         "message": "Connected to sentiment stream",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow()
     })
     
-    metrics_task = asyncio.create_task(broadcast_metrics_loop(websocket))
-    
+    # Clients only listen; live data arrives via the process-wide
+    # new_post_subscriber / global_metrics_broadcaster tasks, never a
+    # per-connection Redis subscription
     try:
         while True:
             await websocket.receive_text()
-            
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
-        metrics_task.cancel()
-    except Exception:
-        manager.disconnect(websocket)
-        metrics_task.cancel()
 
-async def broadcast_metrics_loop(websocket: WebSocket):
+async def global_metrics_broadcaster(interval_seconds: int = 30):
+    """
+    Single background task (started once at app startup) that queries the
+    window metrics and fans them out to every connected client, so DB load
+    does not grow with the number of WebSocket connections.
+    """
     while True:
         try:
-            # Check if socket is still open in manager
-            if websocket not in manager.active_connections:
-                break
+            # Nobody listening - skip the queries entirely
+            if not manager.active_connections:
+                await asyncio.sleep(interval_seconds)
+                continue
                 
+            # One pre-pivoted row per window, so the result maps straight
+            # onto the message without any per-label loop in Python
             async with AsyncSessionLocal() as session:
-                # Last minute
-                last_minute = (await session.execute(text("""
-                    SELECT sentiment_label, COUNT(*) as count
-                    FROM sentiment_analysis
-                    WHERE analyzed_at >= NOW() - INTERVAL '1 minute'
-                    GROUP BY sentiment_label
-                """))).all()
-                
-                # Last hour
-                last_hour = (await session.execute(text("""
-                    SELECT sentiment_label, COUNT(*) as count
-                    FROM sentiment_analysis
-                    WHERE analyzed_at >= NOW() - INTERVAL '1 hour'
-                    GROUP BY sentiment_label
-                """))).all()
-                
-                # Last 24 hours
-                last_24h = (await session.execute(text("""
-                    SELECT sentiment_label, COUNT(*) as count
-                    FROM sentiment_analysis
-                    WHERE analyzed_at >= NOW() - INTERVAL '24 hours'
-                    GROUP BY sentiment_label
-                """))).all()
+                rows = (await session.execute(text("""
+                    SELECT
+                        w.name AS "window",
+                        COALESCE(SUM(r.count) FILTER (WHERE r.label = 'positive'), 0) AS positive,
+                        COALESCE(SUM(r.count) FILTER (WHERE r.label = 'negative'), 0) AS negative,
+                        COALESCE(SUM(r.count) FILTER (WHERE r.label = 'neutral'), 0) AS neutral,
+                        COALESCE(SUM(r.count), 0) AS total
+                    FROM (VALUES
+                        ('last_minute', INTERVAL '1 minute'),
+                        ('last_hour', INTERVAL '1 hour'),
+                        ('last_24_hours', INTERVAL '24 hours')
+                    ) AS w(name, span)
+                    LEFT JOIN sentiment_rollup_minute r
+                        ON r.ts >= date_trunc('minute', NOW() - w.span)
+                    GROUP BY w.name
+                """))).mappings().all()
             
-            def format_counts(rows):
-                counts = {"positive": 0, "negative": 0, "neutral": 0, "total": 0}
-                for row in rows:
-                    counts[row.sentiment_label] = row.count
-                    counts["total"] += row.count
-                return counts
+            data = {}
+            for row in rows:
+                counts = dict(row)
+                data[counts.pop("window")] = counts
             
             metrics_message = {
                 "type": "metrics_update",
-                "data": {
-                    "last_minute": format_counts(last_minute),
-                    "last_hour": format_counts(last_hour),
-                    "last_24_hours": format_counts(last_24h)
-                },
-                "timestamp": datetime.utcnow().isoformat()
+                "data": data,
+                "timestamp": datetime.utcnow()
             }
             
-            # Send only if connection active
-            if websocket in manager.active_connections:
-                await websocket.send_json(metrics_message)
-            else:
-                break
+            await manager.broadcast(metrics_message)
             
         except Exception as e:
             print(f"Error broadcasting metrics: {e}")
         
-        await asyncio.sleep(30)
+        await asyncio.sleep(interval_seconds)
 
-# Hook for worker to call
-async def broadcast_new_post(post_data: dict):
-    message = {
-        "type": "new_post",
-        "data": {
-            "post_id": post_data['post_id'],
-            "content": post_data['content'][:100],
-            "source": post_data['source'],
-            "sentiment_label": post_data.get('sentiment_label', 'unknown'),
-            "confidence_score": post_data.get('confidence_score', 0),
-            "emotion": post_data.get('emotion', 'unknown'),
-            "timestamp": datetime.utcnow().isoformat()
-        }
-    }
-    await manager.broadcast(message)
+async def new_post_subscriber(redis_client, retry_seconds: int = 5):
+    """
+    Background task (one per API process) relaying posts and alerts
+    published on CHANNELS to this process's WebSocket clients subscribed to
+    that channel, so fanout reaches every client however many API workers
+    are running. Publishers send finished frames ({"type": ..., "data": ...}),
+    which are forwarded verbatim without decoding. When nothing arrives for
+    HEARTBEAT_SECONDS every client gets a {"type": "ping"} frame instead.
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(*CHANNELS.values())
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=HEARTBEAT_SECONDS
+                    )
+                    if message is None:
+                        manager.broadcast_payload('{"type":"ping"}')
+                        continue
+                    try:
+                        channel = CHANNEL_NAMES[message["channel"]]
+                        # Decoded once here; text frames for every client
+                        manager.broadcast_payload(message["data"].decode(), channel)
+                    except Exception as e:
+                        print(f"Error relaying new post: {e}")
+        except (RedisError, OSError) as e:
+            print(f"New post subscription lost: {e}")
+        
+        await asyncio.sleep(retry_seconds)
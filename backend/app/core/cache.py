@@ -0,0 +1,69 @@
+# backend/app/core/cache.py
+
+import functools
+import logging
+from typing import Callable, Union
+from urllib.parse import urlencode
+
+import orjson
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "api"
+
+
+def cache_key(request: Request) -> str:
+    """
+    Build a stable key from the route and its (sorted) query string,
+    e.g. "api:sentiment:aggregate:period=hour".
+    """
+    route = request.url.path.strip("/")
+    if route.startswith(f"{CACHE_PREFIX}/"):
+        route = route[len(CACHE_PREFIX) + 1:]
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return f"{CACHE_PREFIX}:{route.replace('/', ':')}:{query}"
+
+
+def cached(ttl_seconds: Union[int, Callable[[Request], int]]):
+    """
+    Cache a GET handler's JSON body in Redis with a short TTL.
+
+    The handler must accept a `request: Request` argument. `ttl_seconds` is
+    either a fixed number of seconds or a callable that derives it from the
+    request (e.g. from the aggregation period). If Redis is not configured on
+    `app.state.redis` or is unreachable, the handler runs uncached.
+    Sentiment entries are dropped by the worker once per saved batch
+    (API_CACHE_PATTERN in worker/worker.py).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs["request"]
+            client = getattr(request.app.state, "redis", None)
+            if client is None:
+                return await func(*args, **kwargs)
+
+            key = cache_key(request)
+            try:
+                hit = await client.get(key)
+            except RedisError as e:
+                logger.debug(f"Cache read failed for {key}: {e}")
+                return await func(*args, **kwargs)
+
+            if hit is not None:
+                return Response(content=hit, media_type="application/json")
+
+            response = await func(*args, **kwargs)
+
+            ttl = ttl_seconds(request) if callable(ttl_seconds) else ttl_seconds
+            try:
+                await client.setex(key, ttl, orjson.dumps(response))
+            except RedisError as e:
+                logger.debug(f"Cache write failed for {key}: {e}")
+
+            return response
+        return wrapper
+    return decorator
+
@@ -1,12 +1,25 @@
 # backend/app/core/database.py
 
 import os
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Sized for the per-request sessions opened by every route; no pre-ping
+# round-trip on checkout, connections recycled before server-side timeouts.
+# The compiled-statement cache is sized above the number of distinct
+# statements (filter combinations included) so entries are not evicted.
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=True,
+    pool_size=20,
+    max_overflow=40,
+    pool_pre_ping=False,
+    pool_recycle=1800,
+    query_cache_size=1200,
+)
 
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -17,10 +30,134 @@ AsyncSessionLocal = sessionmaker(
 Base = declarative_base()
 
 
+# Idempotent DDL applied after create_all() on every startup
+MIGRATIONS = [
+    # Keep sentiment_rollup_minute in sync with sentiment_analysis
+    """
+    CREATE OR REPLACE FUNCTION sentiment_rollup_minute_ingest() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO sentiment_rollup_minute (ts, label, count, sum_conf)
+        SELECT date_trunc('minute', analyzed_at), sentiment_label,
+               COUNT(*), SUM(confidence_score)
+        FROM new_rows
+        GROUP BY 1, 2
+        -- Fixed lock order, so concurrent workers upserting the same
+        -- minutes cannot deadlock
+        ORDER BY 1, 2
+        ON CONFLICT (ts, label) DO UPDATE SET
+            count = sentiment_rollup_minute.count + EXCLUDED.count,
+            sum_conf = sentiment_rollup_minute.sum_conf + EXCLUDED.sum_conf;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE TRIGGER sentiment_rollup_minute_ingest
+    AFTER INSERT ON sentiment_analysis
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sentiment_rollup_minute_ingest()
+    """,
+    # Wake LISTENers on "sentiment_insert" (AlertService) once per INSERT
+    # statement; notifications are delivered on commit
+    """
+    CREATE OR REPLACE FUNCTION sentiment_analysis_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('sentiment_insert', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE TRIGGER sentiment_analysis_notify
+    AFTER INSERT ON sentiment_analysis
+    FOR EACH STATEMENT EXECUTE FUNCTION sentiment_analysis_notify()
+    """,
+    # sentiment_alerts.details was created as json before the model moved to
+    # JSONB; convert it in place once
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'sentiment_alerts' AND column_name = 'details'
+              AND data_type = 'json'
+        ) THEN
+            ALTER TABLE sentiment_alerts ALTER COLUMN details TYPE jsonb USING details::jsonb;
+        END IF;
+    END
+    $$
+    """,
+    # One-time backfill for databases that predate the rollup
+    """
+    INSERT INTO sentiment_rollup_minute (ts, label, count, sum_conf)
+    SELECT date_trunc('minute', analyzed_at), sentiment_label,
+           COUNT(*), SUM(confidence_score)
+    FROM sentiment_analysis
+    WHERE NOT EXISTS (SELECT 1 FROM sentiment_rollup_minute)
+    GROUP BY 1, 2
+    """,
+]
+
+
+# Indexes matching the hot predicates (time-window scans, label filters and
+# the posts <-> analysis join). Built CONCURRENTLY so startup does not block
+# writers on large tables.
+INDEXES = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sentiment_analysis_analyzed_at_label
+    ON sentiment_analysis (analyzed_at, sentiment_label)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sentiment_analysis_post_id
+    ON sentiment_analysis (post_id)
+    """,
+]
+
+
+async def run_migrations(conn):
+    for statement in MIGRATIONS:
+        await conn.execute(text(statement))
+
+
+async def create_indexes():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for statement in INDEXES:
+            await conn.execute(text(statement))
+
+
 async def init_db():
     # 🔥 THIS IMPORT IS MANDATORY
     from app.models import models
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+
+    await create_indexes()
+
+
+
+def estimated_count_sql(table: str) -> str:
+    """
+    Scalar subquery returning the planner's row estimate for `table`
+    (pg_class.reltuples, O(1)) instead of a full COUNT(*) scan.
+    Falls back to an exact count if the table has never been analyzed.
+    `table` must be a trusted identifier, never user input.
+    """
+    return f"""(
+        SELECT CASE
+            WHEN c.reltuples < 0 THEN (SELECT COUNT(*) FROM {table})
+            ELSE c.reltuples::bigint
+        END
+        FROM pg_class c
+        WHERE c.oid = '{table}'::regclass
+    )"""
+
 
+async def fast_row_count(session: AsyncSession, table: str) -> int:
+    """Approximate row count of `table` for dashboard totals."""
+    return (await session.execute(
+        text(f"SELECT {estimated_count_sql(table)}")
+    )).scalar() or 0
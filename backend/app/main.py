@@ -1,17 +1,23 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 import os
-import json
 import asyncio
 import redis.asyncio as redis
+import uvloop
 
 from app.api.routes import router as api_router
-from app.api.aggregate import router as aggregate_router
 from app.core.database import init_db
 from app.core.seed import seed_demo_data   # ✅ ADD THIS
 
-app = FastAPI(title="Sentiment Analysis Platform")
+# asyncpg and redis.asyncio both spend most of their time in the loop
+uvloop.install()
+
+app = FastAPI(
+    title="Sentiment Analysis Platform",
+    default_response_class=ORJSONResponse,
+)
 
 # ---------------- CORS ----------------
 app.add_middleware(
@@ -23,8 +29,8 @@ app.add_middleware(
 )
 
 # ---------------- ROUTERS ----------------
+# aggregate_router is mounted inside api_router
 app.include_router(api_router)
-app.include_router(aggregate_router)
 
 # ---------------- REDIS CONFIG ----------------
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
@@ -32,7 +38,11 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 
 
 # ---------------- WEBSOCKET ----------------
-from app.api.websocket import websocket_endpoint
+from app.api.websocket import (
+    websocket_endpoint,
+    global_metrics_broadcaster,
+    new_post_subscriber,
+)
 
 app.add_api_websocket_route("/ws/sentiment", websocket_endpoint)
 
@@ -40,15 +50,38 @@ app.add_api_websocket_route("/ws/sentiment", websocket_endpoint)
 @app.on_event("startup")
 async def startup():
     await init_db()          # create tables
-    await seed_demo_data()   # seed demo rows IF tables empty
+    await seed_demo_data()   # seed demo rows IF missing
+
+    # One connection pool per process, shared by request handlers and the
+    # single pub/sub subscriber (which holds exactly one connection).
+    # Replies stay bytes: cached bodies and published frames are passed on
+    # without a UTF-8 decode/encode round trip
+    app.state.redis_pool = redis.ConnectionPool.from_url(
+        f"redis://{REDIS_HOST}:{REDIS_PORT}",
+        max_connections=64,
+        decode_responses=False,
+    )
+    app.state.redis = redis.Redis(connection_pool=app.state.redis_pool)
     
     # Start Alert Service
     from app.services.alerting import AlertService
     from app.core.database import AsyncSessionLocal
     
-    alert_service = AlertService(AsyncSessionLocal)
+    alert_service = AlertService(AsyncSessionLocal, app.state.redis)
     asyncio.create_task(alert_service.run_monitoring_loop())
 
+    # One metrics broadcaster for all WebSocket clients
+    asyncio.create_task(global_metrics_broadcaster())
+
+    # Relay worker-published posts to this process's WebSocket clients
+    asyncio.create_task(new_post_subscriber(app.state.redis))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.redis.close()
+    await app.state.redis_pool.disconnect()
+
 
 # ---------------- ROOT ----------------
 @app.get("/")
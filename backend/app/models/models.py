@@ -7,8 +7,8 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     Index,
-    JSON,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from app.core.database import Base
 
@@ -52,6 +52,20 @@ class SentimentAlert(Base):
     window_end = Column(DateTime, nullable=False)
     post_count = Column(Integer, nullable=False)
     triggered_at = Column(DateTime, server_default=func.now(), index=True)
-    details = Column(JSON)
+    details = Column(JSONB)
 
 
+
+
+class SentimentRollupMinute(Base):
+    """
+    Per-minute, per-label counts kept in sync with sentiment_analysis by an
+    AFTER INSERT trigger (see app.core.database.MIGRATIONS). Aggregate reads
+    scan this table instead of the raw analyses.
+    """
+    __tablename__ = "sentiment_rollup_minute"
+
+    ts = Column(DateTime, primary_key=True)
+    label = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum_conf = Column(Float, nullable=False, default=0.0)
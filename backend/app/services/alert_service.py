@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
-from sqlalchemy import text
+from sqlalchemy import Integer, bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
 from app.core.database import AsyncSessionLocal
 import os
 
@@ -7,6 +8,39 @@ NEGATIVE_RATIO_THRESHOLD = float(os.getenv("ALERT_NEGATIVE_RATIO_THRESHOLD", 2.0
 WINDOW_MINUTES = int(os.getenv("ALERT_WINDOW_MINUTES", 5))
 MIN_POSTS = int(os.getenv("ALERT_MIN_POSTS", 10))
 
+# Built once at import rather than on every check
+_CHECK_STMT = text("""
+    SELECT
+        COUNT(*) FILTER (WHERE sentiment_label = 'negative') AS negative_cnt,
+        COUNT(*) AS total_cnt
+    FROM sentiment_analysis
+    WHERE analyzed_at >= NOW() - make_interval(mins => :window)
+""").bindparams(bindparam("window", type_=Integer))
+
+_INSERT_STMT = text("""
+    INSERT INTO sentiment_alerts (
+        alert_type,
+        threshold_value,
+        actual_value,
+        window_start,
+        window_end,
+        post_count,
+        details
+    )
+    VALUES (
+        'NEGATIVE_SENTIMENT_SPIKE',
+        :threshold,
+        :actual,
+        NOW() - make_interval(mins => :window),
+        NOW(),
+        :count,
+        :details
+    )
+""").bindparams(
+    bindparam("window", type_=Integer),
+    bindparam("details", type_=JSONB),
+)
+
 
 async def check_and_trigger_alert():
     """
@@ -14,13 +48,7 @@ async def check_and_trigger_alert():
     """
 
     async with AsyncSessionLocal() as session:
-        result = await session.execute(text("""
-            SELECT
-                COUNT(*) FILTER (WHERE sentiment_label = 'negative') AS negative_cnt,
-                COUNT(*) AS total_cnt
-            FROM sentiment_analysis
-            WHERE analyzed_at >= NOW() - INTERVAL ':window minutes'
-        """), {"window": WINDOW_MINUTES})
+        result = await session.execute(_CHECK_STMT, {"window": WINDOW_MINUTES})
 
         row = result.first()
         if not row:
@@ -34,26 +62,7 @@ async def check_and_trigger_alert():
         ratio = negative_cnt / total_cnt if total_cnt else 0
 
         if ratio >= NEGATIVE_RATIO_THRESHOLD:
-            await session.execute(text("""
-                INSERT INTO sentiment_alerts (
-                    alert_type,
-                    threshold_value,
-                    actual_value,
-                    window_start,
-                    window_end,
-                    post_count,
-                    details
-                )
-                VALUES (
-                    'NEGATIVE_SENTIMENT_SPIKE',
-                    :threshold,
-                    :actual,
-                    NOW() - INTERVAL ':window minutes',
-                    NOW(),
-                    :count,
-                    :details
-                )
-            """), {
+            await session.execute(_INSERT_STMT, {
                 "threshold": NEGATIVE_RATIO_THRESHOLD,
                 "actual": ratio,
                 "window": WINDOW_MINUTES,
@@ -62,4 +71,3 @@ async def check_and_trigger_alert():
             })
 
             await session.commit()
-
@@ -1,4 +1,5 @@
-from sqlalchemy import text
+from sqlalchemy import Integer, bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime, timedelta
 from app.core.database import AsyncSessionLocal
 import os
@@ -7,17 +8,32 @@ NEG_RATIO = float(os.getenv("ALERT_NEGATIVE_RATIO_THRESHOLD", 2.0))
 WINDOW_MIN = int(os.getenv("ALERT_WINDOW_MINUTES", 5))
 MIN_POSTS = int(os.getenv("ALERT_MIN_POSTS", 10))
 
+# Built once at import rather than on every check
+_CHECK_STMT = text("""
+    SELECT
+      SUM(CASE WHEN sentiment_label='negative' THEN 1 ELSE 0 END) AS neg,
+      SUM(CASE WHEN sentiment_label='positive' THEN 1 ELSE 0 END) AS pos,
+      COUNT(*) AS total
+    FROM sentiment_analysis
+    WHERE analyzed_at >= NOW() - make_interval(mins => :m)
+""").bindparams(bindparam("m", type_=Integer))
+
+_INSERT_STMT = text("""
+    INSERT INTO sentiment_alerts
+    (alert_type, threshold_value, actual_value,
+     window_start, window_end, post_count, details)
+    VALUES
+    ('high_negative_ratio', :th, :av,
+     NOW() - make_interval(mins => :m), NOW(), :cnt, :details)
+""").bindparams(
+    bindparam("m", type_=Integer),
+    bindparam("details", type_=JSONB),
+)
+
 
 async def check_and_trigger_alert():
     async with AsyncSessionLocal() as session:
-        result = await session.execute(text("""
-            SELECT
-              SUM(CASE WHEN sentiment_label='negative' THEN 1 ELSE 0 END) AS neg,
-              SUM(CASE WHEN sentiment_label='positive' THEN 1 ELSE 0 END) AS pos,
-              COUNT(*) AS total
-            FROM sentiment_analysis
-            WHERE analyzed_at >= NOW() - INTERVAL ':m minutes'
-        """.replace(":m", str(WINDOW_MIN))))
+        result = await session.execute(_CHECK_STMT, {"m": WINDOW_MIN})
 
         neg, pos, total = result.fetchone()
 
@@ -28,14 +44,8 @@ async def check_and_trigger_alert():
         if ratio <= NEG_RATIO:
             return None
 
-        await session.execute(text("""
-            INSERT INTO sentiment_alerts
-            (alert_type, threshold_value, actual_value,
-             window_start, window_end, post_count, details)
-            VALUES
-            ('high_negative_ratio', :th, :av,
-             NOW() - INTERVAL ':m minutes', NOW(), :cnt, :details)
-        """.replace(":m", str(WINDOW_MIN))), {
+        await session.execute(_INSERT_STMT, {
+            "m": WINDOW_MIN,
             "th": NEG_RATIO,
             "av": ratio,
             "cnt": total,
@@ -1,23 +1,122 @@
 
 import os
 import asyncio
-import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+import asyncpg
+import orjson
+from datetime import datetime
+from typing import List, Optional
 from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.api.websocket import manager
+from redis.exceptions import RedisError
+from app.api.websocket import CHANNELS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Notified by the sentiment_analysis_notify trigger (see app/core/database.py)
+INSERT_NOTIFY_CHANNEL = "sentiment_insert"
+
+# Built once at import: SQLAlchemy's compiled cache and asyncpg's
+# per-connection prepared statement cache both key on this exact statement,
+# so each monitoring tick skips parse/plan.
+# Every rule is checked and saved in one round trip: `recent` reads the
+# widest window once from the per-minute rollup (a handful of rows rather
+# than every analysis), each rule sums its own window from it, and the
+# INSERT only produces rows (and ids) for rules that breach their thresholds
+# and have not already fired within their window (one alert per window).
+_TRIGGER_ALERTS_STMT = text("""
+    WITH rules AS (
+        SELECT * FROM unnest(
+            CAST(:alert_types AS text[]), CAST(:minutes AS int[]),
+            CAST(:thresholds AS float8[]), CAST(:min_posts AS int[])
+        ) AS r(alert_type, minutes, threshold, min_posts)
+    ),
+    recent AS MATERIALIZED (
+        SELECT ts, label, count
+        FROM sentiment_rollup_minute
+        WHERE ts >= date_trunc('minute', NOW() - make_interval(mins => (SELECT MAX(minutes) FROM rules)))
+    ),
+    counts AS (
+        SELECT r.alert_type, r.minutes, r.threshold, r.min_posts,
+            COALESCE(SUM(a.count) FILTER (WHERE a.label = 'positive'), 0) as positive_count,
+            COALESCE(SUM(a.count) FILTER (WHERE a.label = 'negative'), 0) as negative_count,
+            COALESCE(SUM(a.count) FILTER (WHERE a.label = 'neutral'), 0) as neutral_count,
+            COALESCE(SUM(a.count), 0) as total_count
+        FROM rules r
+        LEFT JOIN recent a ON a.ts >= date_trunc('minute', NOW() - make_interval(mins => r.minutes))
+        GROUP BY r.alert_type, r.minutes, r.threshold, r.min_posts
+    ),
+    agg AS (
+        SELECT *,
+            -- negative/positive; with no positives the ratio is the negative count
+            CASE WHEN positive_count = 0 THEN negative_count::float
+                 ELSE negative_count::float / positive_count
+            END AS ratio
+        FROM counts
+    )
+    INSERT INTO sentiment_alerts (
+        alert_type, threshold_value, actual_value, 
+        window_start, window_end, post_count, details, triggered_at
+    )
+    SELECT
+        alert_type, threshold, round(ratio::numeric, 2),
+        NOW() - make_interval(mins => minutes), NOW(), total_count,
+        jsonb_build_object(
+            'positive_count', positive_count,
+            'negative_count', negative_count,
+            'neutral_count', neutral_count,
+            'total_count', total_count
+        ),
+        NOW()
+    FROM agg
+    WHERE total_count >= min_posts AND ratio > threshold
+      AND NOT EXISTS (
+          SELECT 1 FROM sentiment_alerts s
+          WHERE s.alert_type = agg.alert_type
+            AND s.triggered_at > NOW() - make_interval(mins => agg.minutes)
+      )
+    RETURNING id, alert_type, threshold_value, actual_value,
+              window_start, window_end, post_count, details
+""")
+
+# Rolling per-minute replay of a rule's window over the rollup: one ordered
+# scan with a RANGE frame instead of re-counting the window for every minute
+_HISTORY_STMT = text("""
+    WITH per_minute AS (
+        SELECT ts,
+            SUM(count) FILTER (WHERE label = 'positive') as positive_count,
+            SUM(count) FILTER (WHERE label = 'negative') as negative_count,
+            SUM(count) as total_count
+        FROM sentiment_rollup_minute
+        WHERE ts >= date_trunc('minute', CAST(:start_date AS timestamp)) - make_interval(mins => :minutes)
+          AND ts <= :end_date
+        GROUP BY ts
+    ),
+    rolling AS (
+        SELECT ts,
+            COALESCE(SUM(positive_count) OVER w, 0)::bigint as positive_count,
+            COALESCE(SUM(negative_count) OVER w, 0)::bigint as negative_count,
+            (SUM(total_count) OVER w)::bigint as total_count
+        FROM per_minute
+        WINDOW w AS (ORDER BY ts RANGE BETWEEN make_interval(mins => :minutes) PRECEDING AND CURRENT ROW)
+    )
+    SELECT ts as minute, positive_count, negative_count, total_count,
+        CASE WHEN positive_count = 0 THEN negative_count::float
+             ELSE negative_count::float / positive_count
+        END AS ratio
+    FROM rolling
+    WHERE ts >= date_trunc('minute', CAST(:start_date AS timestamp))
+    ORDER BY ts
+""")
+
 class AlertService:
     """
     Monitors sentiment metrics and triggers alerts on anomalies
     """
     
-    def __init__(self, db_session_maker):
+    def __init__(self, db_session_maker, redis_client=None):
         """
         Initialize with configuration from environment variables
         
@@ -25,97 +124,153 @@ class AlertService:
         - ALERT_NEGATIVE_RATIO_THRESHOLD (default: 2.0)
         - ALERT_WINDOW_MINUTES (default: 5)
         - ALERT_MIN_POSTS (default: 10)
+
+        Rules are evaluated shortly after new analyses are committed
+        (LISTEN on INSERT_NOTIFY_CHANNEL); if the listener cannot connect,
+        the service falls back to polling every check_interval seconds.
+        Triggered alerts are published on the "alerts" channel when a
+        redis_client is given.
         """
         self.db_session_maker = db_session_maker
+        self.redis_client = redis_client
         self.ratio_threshold = float(os.getenv("ALERT_NEGATIVE_RATIO_THRESHOLD", "2.0"))
         self.window_minutes = int(os.getenv("ALERT_WINDOW_MINUTES", "5"))
         self.min_posts = int(os.getenv("ALERT_MIN_POSTS", "10"))
-        self.check_interval = 60  # Check every minute
+        self.check_interval = 60  # Poll / reconnect every minute
+        self.debounce_seconds = 0.5  # Inserts within this delay share one check
+        self.max_debounce_seconds = 5.0  # A steady stream of inserts still gets checked
+        self._pending_check: Optional[asyncio.Task] = None
+        self._pending_since = 0.0
+        self._check_running = False
+        self._recheck = False
+        # All rules are evaluated together by trigger_alerts()
+        self.rules = [
+            {
+                "alert_type": "high_negative_ratio",
+                "minutes": self.window_minutes,
+                "threshold": self.ratio_threshold,
+                "min_posts": self.min_posts,
+            },
+        ]
         self._running = False
         
-    async def check_thresholds(self) -> Optional[dict]:
+    async def trigger_alerts(self) -> List[dict]:
         """
-        Check if current sentiment metrics exceed alert thresholds
+        Evaluate every rule and save an alert for each one that breaches its
+        thresholds, in a single statement. Returns the saved alerts.
         """
         async with self.db_session_maker() as session:
-            # 1. Count positive/negative posts in last ALERT_WINDOW_MINUTES
-            query = text("""
-                SELECT 
-                    COUNT(*) FILTER (WHERE sentiment_label = 'positive') as positive_count,
-                    COUNT(*) FILTER (WHERE sentiment_label = 'negative') as negative_count,
-                    COUNT(*) FILTER (WHERE sentiment_label = 'neutral') as neutral_count,
-                    COUNT(*) as total_count
-                FROM sentiment_analysis
-                WHERE analyzed_at >= NOW() - INTERVAL ':minutes minutes'
-            """)
-            
-            result = (await session.execute(
-                query, 
-                {"minutes": self.window_minutes}
-            )).first()
-            
-            if not result or result.total_count < self.min_posts:
-                return None
-            
-            # 3. Calculate ratio
-            positive = result.positive_count
-            negative = result.negative_count
-            
-            # Avoid division by zero
-            if positive == 0:
-                ratio = float(negative) if negative > 0 else 0.0
-            else:
-                ratio = negative / positive
-            
-            # 4. If ratio > threshold, trigger alert
-            if ratio > self.ratio_threshold:
-                return {
-                    "alert_triggered": True,
-                    "alert_type": "high_negative_ratio",
-                    "threshold_value": self.ratio_threshold,
-                    "actual_value": round(ratio, 2),
-                    "window_start": (datetime.utcnow() - timedelta(minutes=self.window_minutes)).isoformat(),
-                    "window_end": datetime.utcnow().isoformat(),
-                    "post_count": result.total_count,
-                    "details": {
-                        "positive_count": result.positive_count,
-                        "negative_count": result.negative_count,
-                        "neutral_count": result.neutral_count,
-                        "total_count": result.total_count
-                    }
-                }
-            
-            return None
+            result = (await session.execute(_TRIGGER_ALERTS_STMT, {
+                "alert_types": [rule["alert_type"] for rule in self.rules],
+                "minutes": [rule["minutes"] for rule in self.rules],
+                "thresholds": [rule["threshold"] for rule in self.rules],
+                "min_posts": [rule["min_posts"] for rule in self.rules],
+            })).mappings().all()
+            await session.commit()
+
+        alerts = [dict(row) for row in result]
+        for alert_data in alerts:
+            logger.warning(f"🚨 Alert Triggered: {alert_data['alert_type']} (Ratio: {alert_data['actual_value']})")
+        return alerts
 
-    async def save_alert(self, alert_data: dict) -> int:
+    async def check_history(self, start_date: datetime, end_date: datetime, rule: Optional[dict] = None) -> List[dict]:
         """
-        Save alert to database
+        Replay a rule (the first one by default) over past data: for every
+        minute with analyses between start_date and end_date, the counts in
+        the window ending at that minute and whether the rule would fire.
+        Nothing is saved.
         """
+        rule = rule or self.rules[0]
         async with self.db_session_maker() as session:
-            query = text("""
-                INSERT INTO sentiment_alerts (
-                    alert_type, threshold_value, actual_value, 
-                    window_start, window_end, post_count, details, triggered_at
-                ) VALUES (
-                    :alert_type, :threshold_value, :actual_value,
-                    :window_start, :window_end, :post_count, :details, NOW()
-                ) RETURNING id
-            """)
-            
-            result = await session.execute(query, {
-                "alert_type": alert_data["alert_type"],
-                "threshold_value": alert_data["threshold_value"],
-                "actual_value": alert_data["actual_value"],
-                "window_start": datetime.fromisoformat(alert_data["window_start"]),
-                "window_end": datetime.fromisoformat(alert_data["window_end"]),
-                "post_count": alert_data["post_count"],
-                "details": json.dumps(alert_data["details"])
-            })
-            
-            await session.commit()
-            alert_id = result.scalar()
-            logger.warning(f"🚨 Alert Triggered: {alert_data['alert_type']} (Ratio: {alert_data['actual_value']})")
-            return alert_id
+            rows = (await session.execute(_HISTORY_STMT, {
+                "start_date": start_date,
+                "end_date": end_date,
+                "minutes": rule["minutes"],
+            })).mappings().all()
+
+        return [
+            {
+                **row,
+                "triggered": row["total_count"] >= rule["min_posts"] and row["ratio"] > rule["threshold"],
+            }
+            for row in rows
+        ]
+
+    async def publish_alert(self, alert_data: dict):
+        """
+        Publish a saved alert for every API process to relay to its clients
+        """
+        if self.redis_client is None:
+            return
+        try:
+            # Published as the finished WebSocket frame
+            frame = orjson.dumps({"type": "alert", "data": alert_data})
+            await self.redis_client.publish(CHANNELS["alerts"], frame)
+        except RedisError as e:
+            logger.warning(f"Could not publish alert: {e}")
+
+    async def check_and_publish(self):
+        """
+        Evaluate all rules and notify clients of any triggered alerts
+        """
+        try:
+            alerts = await self.trigger_alerts()
+            # Notify WebSocket clients subscribed to alerts
+            await asyncio.gather(*(self.publish_alert(alert_data) for alert_data in alerts))
+        except Exception as e:
+            logger.error(f"Error in alert monitoring loop: {e}")
+
+    def schedule_check(self, delay: float = 0.0):
+        """
+        Run check_and_publish() in the background after `delay` seconds, so
+        neither the listener nor the monitoring loop waits on the INSERT.
+
+        Debounced: a newer insert restarts a pending delay (for at most
+        max_debounce_seconds after the first one). At most one check runs
+        at a time; inserts that arrive while it runs get one more check
+        after it finishes, so the last insert of a burst is always seen.
+        """
+        if self._check_running:
+            self._recheck = True
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._pending_check and not self._pending_check.done():
+            if loop.time() - self._pending_since >= self.max_debounce_seconds:
+                return
+            self._pending_check.cancel()
+        else:
+            self._pending_since = loop.time()
+        self._pending_check = asyncio.create_task(self._delayed_check(delay))
+
+    async def _delayed_check(self, delay: float):
+        await asyncio.sleep(delay)
+        self._check_running = True
+        try:
+            await self.check_and_publish()
+        finally:
+            self._check_running = False
+        if self._recheck:
+            # This task is finishing; the follow-up must not restart it
+            self._recheck = False
+            self._pending_check = None
+            self.schedule_check(self.debounce_seconds)
+
+    def _on_insert(self, connection, pid, channel, payload):
+        self.schedule_check(self.debounce_seconds)
+
+    async def _listen(self) -> Optional[asyncpg.Connection]:
+        """
+        Open a dedicated asyncpg connection LISTENing for new analyses
+        """
+        try:
+            dsn = make_url(os.getenv("DATABASE_URL")).set(drivername="postgresql")
+            connection = await asyncpg.connect(dsn.render_as_string(hide_password=False))
+            await connection.add_listener(INSERT_NOTIFY_CHANNEL, self._on_insert)
+            return connection
+        except Exception as e:
+            logger.warning(f"Alert listener unavailable, polling instead: {e}")
+            return None
 
     async def run_monitoring_loop(self):
         """
@@ -123,23 +278,20 @@ class AlertService:
         """
         logger.info("Starting Alert Monitoring Service...")
         self._running = True
+        listener = None
         
-        while self._running:
-            try:
-                alert_data = await self.check_thresholds()
+        try:
+            while self._running:
+                if listener is None or listener.is_closed():
+                    listener = await self._listen()
+                    # Catches up on anything inserted while not listening;
+                    # doubles as the polling fallback while it is down
+                    self.schedule_check()
                 
-                if alert_data:
-                    # Save to DB
-                    await self.save_alert(alert_data)
-                    
-                    # Notify via WebSocket (optional but good for real-time)
-                    # We can reuse the socket manager if accessible
-                    # await manager.broadcast({"type": "alert", "data": alert_data})
-                    
-            except Exception as e:
-                logger.error(f"Error in alert monitoring loop: {e}")
-            
-            await asyncio.sleep(self.check_interval)
+                await asyncio.sleep(self.check_interval)
+        finally:
+            if listener is not None:
+                await listener.close()
 
     def stop(self):
         self._running = False
@@ -1,18 +1,204 @@
 import os
 import asyncio
-from typing import Dict, List, Optional
+import functools
+import hashlib
+import tempfile
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Final, List, Mapping, Optional, Set, Tuple
 from transformers import pipeline
 import httpx
 import logging
-import json
+import orjson
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Default texts per forward pass in batch_analyze
+BATCH_SIZE = 32
+
+# Sequence-length bucket batch_analyze pads to for torch.compile'd models
+COMPILED_PAD_MULTIPLE = 32
+
+# File name optimum's ORTQuantizer gives the INT8 model
+QUANTIZED_ONNX_FILE = "model_quantized.onnx"
+
+# Model emotion labels folded onto the emotions the platform reports;
+# read-only, built once at import
+EMOTION_MAP: Final[Mapping[str, str]] = MappingProxyType({
+    'joy': 'joy',
+    'sadness': 'sadness',
+    'anger': 'anger',
+    'fear': 'fear',
+    'surprise': 'surprise',
+    'neutral': 'neutral',
+    'disgust': 'anger',
+    'love': 'joy'
+})
+
+@functools.lru_cache(maxsize=None)
+def normalize_sentiment_label(raw_label: str) -> str:
+    """
+    Map a model's raw label (POSITIVE, NEG, LABEL_1, ...) to positive,
+    negative or neutral. Models emit a handful of distinct labels, so each
+    is normalised once.
+    """
+    label = raw_label.lower()
+    if 'pos' in label or label == 'positive':
+        return 'positive'
+    elif 'neg' in label or label == 'negative':
+        return 'negative'
+    return 'neutral'
+
+# Texts per prompt when batch_analyze goes to an external LLM
+EXTERNAL_BATCH_SIZE = 20
+
+# Fixed instructions for the external LLM; the text(s) are appended
+SENTIMENT_PROMPT_PREFIX = """Analyze the sentiment of this text and respond ONLY with a JSON object (no markdown, no explanation):
+{"sentiment_label": "positive" or "negative" or "neutral", "confidence_score": 0.0 to 1.0}
+
+Text: """
+
+BATCH_SENTIMENT_PROMPT_PREFIX = """Analyze the sentiment of each numbered text and respond ONLY with a JSON array (no markdown, no explanation) holding one object per text, in order:
+[{"sentiment_label": "positive" or "negative" or "neutral", "confidence_score": 0.0 to 1.0}, ...]
+
+Texts:
+"""
+
+EMOTION_PROMPT_PREFIX = """Detect the primary emotion in this text. Respond ONLY with JSON:
+{"emotion": "joy" or "sadness" or "anger" or "fear" or "surprise" or "neutral", "confidence_score": 0.0 to 1.0}
+
+Text: """
+
+# Providers whose chat completions can be streamed (OpenAI-compatible SSE)
+STREAMING_CHAT_URLS = {
+    'groq': "https://api.groq.com/openai/v1/chat/completions",
+    'openai': "https://api.openai.com/v1/chat/completions",
+}
+
+# Window in which concurrent external analyses are merged into one prompt
+EXTERNAL_BATCH_WINDOW_MS = int(os.getenv('EXTERNAL_BATCH_WINDOW_MS', 20))
+
+# Distinct texts whose sentiment is remembered (reposts, boilerplate)
+SENTIMENT_CACHE_SIZE = 10_000
+
+# How long the micro-batcher waits for more concurrent texts once it has one
+MAX_BATCH_WAIT_SECONDS = 0.005
+
+class MicroBatcher:
+    """
+    Single consumer in front of a pipeline: concurrent submit() calls are
+    queued and the consumer drains up to `max_batch_size` of them (waiting
+    at most `max_wait` for stragglers) into one `run_batch(texts)` call in
+    the default executor, so the model runs one padded batch at a time
+    instead of many single-text calls contending for the CPU.
+    
+    A coroutine `run_batch` (network-bound, e.g. an LLM API) is awaited on
+    the loop instead, and its batches may overlap. Exceptions returned in
+    place of a result are raised to that text's caller only.
+    """
+    def __init__(self, run_batch, max_batch_size: int = BATCH_SIZE,
+                 max_wait: float = MAX_BATCH_WAIT_SECONDS):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+    
+    async def submit(self, text: str) -> Dict:
+        # Started on first use, on whichever loop is running
+        if self._consumer is None or self._consumer.done():
+            self._queue = asyncio.Queue()
+            self._consumer = asyncio.create_task(self._consume(self._queue))
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    async def close(self):
+        """
+        Stop the consumer; the next submit() starts a new one.
+        """
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+        for task in list(self._batches):
+            task.cancel()
+    
+    async def _consume(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            
+            texts = [text for text, _ in batch]
+            if asyncio.iscoroutinefunction(self.run_batch):
+                task = asyncio.create_task(self._resolve(batch, self.run_batch(texts)))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+            else:
+                await self._resolve(batch, loop.run_in_executor(None, self.run_batch, texts))
+    
+    async def _resolve(self, batch: list, pending):
+        try:
+            results = await pending
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+class TracedClassifier:
+    """
+    Stands in for a pipeline's model after TorchScript tracing: the pipeline
+    calls model(**inputs) and reads .logits, while the traced module takes
+    positional tensors and returns a dict/tuple. Everything else (config,
+    device, ...) is read from the original model.
+    """
+    def __init__(self, model, traced):
+        self._model = model
+        self._traced = traced
+    
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        from transformers.modeling_outputs import SequenceClassifierOutput
+        
+        outputs = self._traced(input_ids, attention_mask)
+        logits = outputs['logits'] if isinstance(outputs, dict) else outputs[0]
+        return SequenceClassifierOutput(logits=logits)
+    
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
 class SentimentAnalyzer:
-    def __init__(self, model_type: str = 'local', model_name: str = None):
+    def __init__(self, model_type: str = 'local', model_name: str = None,
+                 batch_size: int = BATCH_SIZE):
         self.model_type = model_type
+        # Raise on hardware that can take larger padded batches
+        self.batch_size = batch_size
+        
+        # LRU of sentiment results by text digest, plus analyses in flight
+        # so concurrent identical texts share one model/API call
+        self._sentiment_cache: OrderedDict = OrderedDict()
+        self._sentiment_inflight: Dict[bytes, asyncio.Future] = {}
         
         if model_type == 'local':
             self.model_name = model_name or os.getenv(
@@ -24,20 +210,48 @@ class SentimentAnalyzer:
                 'j-hartmann/emotion-english-distilroberta-base'
             )
             
+            # Intra-op threads for torch; inter-op pinned to 1 since the
+            # micro-batchers already run one forward pass at a time
+            if os.getenv('TORCH_NUM_THREADS'):
+                self._configure_torch_threads(int(os.getenv('TORCH_NUM_THREADS')))
+            
+            # CUDA device 0 when available, else CPU (-1); SENTIMENT_DEVICE
+            # overrides with an explicit index
+            self.device = self._resolve_device()
+            
+            # ONNX Runtime replaces the PyTorch models, so the torch-level
+            # optimizations (quantize/trace/compile) are skipped with it
+            self.use_onnx = os.getenv('SENTIMENT_ONNX', '0') == '1'
+            load = self._load_onnx_pipeline if self.use_onnx else self._load_pipeline
+            
             logger.info(f"Loading local sentiment model: {self.model_name}")
-            self.sentiment_pipeline = pipeline(
-                "text-classification",
-                model=self.model_name,
-                device=-1
-            )
+            self.sentiment_pipeline = load(self.model_name)
             
             logger.info(f"Loading local emotion model: {self.emotion_model_name}")
-            self.emotion_pipeline = pipeline(
-                "text-classification",
-                model=self.emotion_model_name,
-                device=-1
+            self.emotion_pipeline = load(self.emotion_model_name)
+            
+            # batch_analyze tokenizes separately from the forward pass
+            self.sentiment_tokenizer = self.sentiment_pipeline.tokenizer
+            self.pad_to_multiple_of = None
+            
+            # Concurrent single-text calls share one forward pass
+            self._sentiment_batcher = MicroBatcher(
+                lambda texts: self.sentiment_pipeline(
+                    texts, batch_size=len(texts), truncation=True, max_length=512
+                ),
+                max_batch_size=self.batch_size
+            )
+            self._emotion_batcher = MicroBatcher(
+                lambda texts: self.emotion_pipeline(
+                    texts, batch_size=len(texts), truncation=True, max_length=512
+                ),
+                max_batch_size=self.batch_size
             )
             
+            if not self.use_onnx:
+                for local_pipeline in (self.sentiment_pipeline, self.emotion_pipeline):
+                    self._optimize_torch_model(local_pipeline)
+            
         elif model_type == 'external':
             self.provider = os.getenv('EXTERNAL_LLM_PROVIDER', 'groq')
             self.api_key = os.getenv('EXTERNAL_LLM_API_KEY')
@@ -47,41 +261,283 @@ class SentimentAnalyzer:
                 raise ValueError("EXTERNAL_LLM_API_KEY environment variable required")
             
             self.model_name = f"{self.provider}:{self.external_model}"
-            self.client = httpx.AsyncClient(timeout=30.0)
+            # Request headers built once per analyzer, not per call
+            self._bearer_headers = {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+            self._anthropic_headers = {
+                "x-api-key": self.api_key,
+                "anthropic-version": "2023-06-01",
+                "Content-Type": "application/json"
+            }
+            # HTTP/2 lets concurrent classifications share one connection;
+            # idle connections are kept for reuse instead of re-handshaking
+            self.client = httpx.AsyncClient(
+                timeout=30.0,
+                transport=httpx.AsyncHTTPTransport(
+                    http2=True,
+                    retries=1,
+                    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+                )
+            )
             
+            # Concurrent analyze_sentiment calls share one upstream request
+            self._external_batcher = MicroBatcher(
+                self._external_sentiment_batch,
+                max_batch_size=EXTERNAL_BATCH_SIZE,
+                max_wait=EXTERNAL_BATCH_WINDOW_MS / 1000
+            )
+            
+    def _configure_torch_threads(self, num_threads: int):
+        import torch
+        
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only settable before torch's first parallel work in the process
+            logger.warning("torch inter-op threads already initialised, leaving as is")
+    
+    def _resolve_device(self) -> int:
+        if os.getenv('SENTIMENT_DEVICE'):
+            return int(os.getenv('SENTIMENT_DEVICE'))
+        try:
+            import torch
+        except ImportError:
+            return -1
+        return 0 if torch.cuda.is_available() else -1
+    
+    def _load_pipeline(self, model_name: str):
+        torch_dtype = None
+        if self.device >= 0:
+            import torch
+            
+            # Half precision on the GPU; CPU stays on float32
+            torch_dtype = torch.float16
+        
+        return pipeline(
+            "text-classification",
+            model=model_name,
+            device=self.device,
+            torch_dtype=torch_dtype
+        )
+    
+    def _load_onnx_pipeline(self, model_name: str):
+        """
+        Same text-classification pipeline, backed by an ONNX Runtime session
+        with every graph optimization (constant folding, op fusion) enabled.
+        The model is exported to ONNX on load unless SENTIMENT_ONNX_DIR holds
+        a pre-exported copy (<dir>/<model name with / replaced by __>).
+        With SENTIMENT_QUANTIZE the graph is quantized to INT8 as well.
+        """
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+        
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = int(os.getenv('SENTIMENT_ONNX_THREADS', 4))
+        load_kwargs = {'provider': "CPUExecutionProvider", 'session_options': session_options}
+        
+        export_dir = os.getenv('SENTIMENT_ONNX_DIR')
+        exported = export_dir and os.path.join(export_dir, model_name.replace('/', '__'))
+        if exported and os.path.isdir(exported):
+            source, export = exported, False
+        else:
+            source, export = model_name, True
+        
+        quantize = os.getenv('SENTIMENT_QUANTIZE', '0') == '1'
+        if quantize and not export and os.path.isfile(os.path.join(source, QUANTIZED_ONNX_FILE)):
+            # Quantized on an earlier start
+            model = ORTModelForSequenceClassification.from_pretrained(
+                source, file_name=QUANTIZED_ONNX_FILE, **load_kwargs
+            )
+        else:
+            model = ORTModelForSequenceClassification.from_pretrained(source, export=export, **load_kwargs)
+            if quantize:
+                # Next to a pre-exported copy so later starts reuse it
+                save_dir = source if not export else tempfile.mkdtemp(prefix="onnx-int8-")
+                model = self._quantize_onnx_model(model, save_dir, load_kwargs)
+        
+        return pipeline(
+            "text-classification",
+            model=model,
+            tokenizer=AutoTokenizer.from_pretrained(source)
+        )
+    
+    def _quantize_onnx_model(self, model, save_dir: str, load_kwargs: Dict):
+        """
+        Dynamic INT8 quantization of an ONNX model (weights quantized ahead
+        of time, activations at run time), reloaded from save_dir. The
+        AVX512-VNNI config still runs on CPUs without VNNI, just slower.
+        """
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(model).quantize(save_dir=save_dir, quantization_config=qconfig)
+        return ORTModelForSequenceClassification.from_pretrained(
+            save_dir, file_name=QUANTIZED_ONNX_FILE, **load_kwargs
+        )
+    
+    def _optimize_torch_model(self, local_pipeline):
+        """
+        Apply the opt-in PyTorch optimizations to a loaded pipeline.
+        """
+        # Fused attention kernels (scaled_dot_product_attention, padding
+        # skipped via nested tensors) replace the encoder layers first
+        if os.getenv('SENTIMENT_BETTERTRANSFORMER', '0') == '1':
+            self._to_bettertransformer(local_pipeline)
+        
+        # INT8 weights first, so tracing/compiling sees the quantized model.
+        # Dynamic quantization only runs on CPU
+        if os.getenv('SENTIMENT_QUANTIZE', '0') == '1':
+            if self.device >= 0:
+                logger.warning("SENTIMENT_QUANTIZE ignored on GPU")
+            else:
+                self._quantize_model(local_pipeline)
+        
+        # TorchScript and torch.compile are alternatives; tracing wins if
+        # both are set
+        if os.getenv('SENTIMENT_TORCHSCRIPT', '0') == '1':
+            self._trace_model(local_pipeline)
+        elif os.getenv('SENTIMENT_TORCH_COMPILE', '0') == '1':
+            self._compile_model(local_pipeline)
+    
+    def _to_bettertransformer(self, local_pipeline):
+        """
+        Convert the model to BetterTransformer (needs optimum). Models or
+        versions without support keep the eager model.
+        """
+        try:
+            local_pipeline.model = local_pipeline.model.to_bettertransformer()
+        except (ImportError, NotImplementedError, ValueError) as e:
+            logger.warning(f"BetterTransformer unavailable, keeping eager model: {e}")
+    
+    def _quantize_model(self, local_pipeline):
+        """
+        Swap the model's Linear layers for dynamically quantized INT8 ones
+        (CPU inference only).
+        """
+        import torch
+        
+        local_pipeline.model = torch.quantization.quantize_dynamic(
+            local_pipeline.model,
+            {torch.nn.Linear},
+            dtype=torch.qint8
+        )
+    
+    def _compile_model(self, local_pipeline):
+        """
+        Wrap a pipeline's model with torch.compile (dynamic shapes, so new
+        sequence lengths don't each force a recompile) and warm it up at the
+        micro-batchers' full batch size, so compilation happens at startup
+        instead of on the first posts. Needs torch 2.x; older versions keep
+        the eager model.
+        """
+        import torch
+        
+        if int(torch.__version__.split('.')[0]) < 2:
+            logger.warning(f"torch {torch.__version__} has no torch.compile, keeping eager model")
+            return
+        
+        local_pipeline.model = torch.compile(
+            local_pipeline.model,
+            mode="reduce-overhead",
+            fullgraph=False,
+            dynamic=True
+        )
+        local_pipeline(["warmup"] * self.batch_size, batch_size=self.batch_size)
+        # batch_analyze pads to length buckets, keeping the shapes it
+        # feeds the compiled graph to a few
+        self.pad_to_multiple_of = COMPILED_PAD_MULTIPLE
+    
+    def _trace_model(self, local_pipeline):
+        """
+        Replace a pipeline's model with a frozen TorchScript trace of it.
+        Falls back to the eager model if tracing fails.
+        """
+        import torch
+        
+        try:
+            example = local_pipeline.tokenizer(
+                "this is a warmup",
+                padding='max_length',
+                max_length=128,
+                truncation=True,
+                return_tensors='pt'
+            )
+            with torch.no_grad():
+                traced = torch.jit.trace(
+                    local_pipeline.model.eval(),
+                    (example['input_ids'], example['attention_mask']),
+                    strict=False
+                )
+            local_pipeline.model = TracedClassifier(
+                local_pipeline.model, torch.jit.freeze(traced)
+            )
+        except Exception as e:
+            logger.warning(f"TorchScript trace failed, keeping eager model: {e}")
+    
     async def analyze_sentiment(self, text: str) -> Dict:
-        if not text or len(text.strip()) == 0:
+        # Truncate first so the blank check never scans past 2000 chars
+        text = text[:2000] if text else ""
+        if not text.strip():
             raise ValueError("Text cannot be empty")
         
-        text = text[:2000]
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        
+        cached = self._sentiment_cache.get(key)
+        if cached is not None:
+            self._sentiment_cache.move_to_end(key)
+            return dict(cached)
+        
+        task = self._sentiment_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_sentiment_uncached(text))
+            self._sentiment_inflight[key] = task
+            task.add_done_callback(functools.partial(self._cache_sentiment, key))
         
+        # Shielded: a cancelled caller must not cancel the shared analysis
+        return dict(await asyncio.shield(task))
+    
+    async def _analyze_sentiment_uncached(self, text: str) -> Dict:
         if self.model_type == 'local':
-            result = self.sentiment_pipeline(text)[0]
-            
-            label = result['label'].lower()
-            if 'pos' in label or label == 'positive':
-                sentiment_label = 'positive'
-            elif 'neg' in label or label == 'negative':
-                sentiment_label = 'negative'
-            else:
-                sentiment_label = 'neutral'
-            
-            return {
-                'sentiment_label': sentiment_label,
-                'confidence_score': float(result['score']),
-                'model_name': self.model_name
-            }
+            return self._map_label(await self._sentiment_batcher.submit(text))
             
         else:
-            return await self._external_sentiment(text)
+            return await self._external_batcher.submit(text)
+    
+    def _cache_sentiment(self, key: bytes, task: asyncio.Future):
+        self._sentiment_inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        # Placeholders from a failed analysis are retried on the next call
+        if task.result().get('fallback'):
+            return
+        self._sentiment_cache[key] = task.result()
+        if len(self._sentiment_cache) > SENTIMENT_CACHE_SIZE:
+            self._sentiment_cache.popitem(last=False)
+    
+    async def analyze_all(self, text: str) -> Tuple[Dict, Dict]:
+        """
+        Sentiment and emotion for one text. Both run at once, each through
+        its own micro-batcher, so the two forward passes overlap instead of
+        running back to back.
+        """
+        return await asyncio.gather(
+            self.analyze_sentiment(text),
+            self.analyze_emotion(text)
+        )
     
     async def analyze_emotion(self, text: str) -> Dict:
-        if not text or len(text.strip()) == 0:
+        text = text[:2000] if text else ""
+        stripped = text.strip()
+        if not stripped:
             raise ValueError("Text cannot be empty")
         
-        text = text[:2000]
-        
-        if len(text.strip()) < 10:
+        if len(stripped) < 10:
             return {
                 'emotion': 'neutral',
                 'confidence_score': 1.0,
@@ -89,21 +545,9 @@ class SentimentAnalyzer:
             }
         
         if self.model_type == 'local':
-            result = self.emotion_pipeline(text)[0]
-            
-            emotion_map = {
-                'joy': 'joy',
-                'sadness': 'sadness',
-                'anger': 'anger',
-                'fear': 'fear',
-                'surprise': 'surprise',
-                'neutral': 'neutral',
-                'disgust': 'anger',
-                'love': 'joy'
-            }
+            result = await self._emotion_batcher.submit(text)
             
-            detected_emotion = result['label'].lower()
-            emotion = emotion_map.get(detected_emotion, 'neutral')
+            emotion = EMOTION_MAP.get(result['label'].lower(), 'neutral')
             
             return {
                 'emotion': emotion,
@@ -119,29 +563,46 @@ class SentimentAnalyzer:
         
         if self.model_type == 'local':
             try:
-                # Use pipeline batching for efficiency
-                # Truncate texts to 512 chars to avoid token limit issues in batch
-                safe_texts = [t[:512] for t in texts]
+                # Same character cap as analyze_sentiment; the tokenizer
+                # truncates to the model's 512-token limit
+                safe_texts = [t[:2000] for t in texts]
+                # Chunk in length order so each chunk pads to a similar
+                # length; results are put back in input order at the end
+                order = sorted(range(len(safe_texts)), key=lambda i: len(safe_texts[i]))
+                sorted_texts = [safe_texts[i] for i in order]
+                chunks = [sorted_texts[i:i + self.batch_size] for i in range(0, len(sorted_texts), self.batch_size)]
                 
-                # Batch processing for sentiment
-                sentiment_results = self.sentiment_pipeline(safe_texts, batch_size=len(texts))
+                loop = asyncio.get_running_loop()
+                tokenize = functools.partial(
+                    self.sentiment_tokenizer,
+                    padding='longest',
+                    pad_to_multiple_of=self.pad_to_multiple_of,
+                    truncation=True,
+                    max_length=512,
+                    return_tensors='pt'
+                )
                 
+                # Padded forward passes of batch_size texts, off the event
+                # loop; the next chunk is tokenized while the current one is
+                # in the model (both release the GIL)
                 results = []
-                for i, res in enumerate(sentiment_results):
-                    label = res['label'].lower()
-                    if 'pos' in label or label == 'positive':
-                        sentiment_label = 'positive'
-                    elif 'neg' in label or label == 'negative':
-                        sentiment_label = 'negative'
-                    else:
-                        sentiment_label = 'neutral'
-                        
-                    results.append({
-                        'sentiment_label': sentiment_label,
-                        'confidence_score': float(res['score']),
-                        'model_name': self.model_name
-                    })
-                return results
+                pending = loop.run_in_executor(None, tokenize, chunks[0])
+                for i, chunk in enumerate(chunks):
+                    encoded = await pending
+                    if i + 1 < len(chunks):
+                        pending = loop.run_in_executor(None, tokenize, chunks[i + 1])
+                    
+                    outputs = await loop.run_in_executor(None, self.sentiment_pipeline.forward, encoded)
+                    logits = outputs['logits']
+                    results.extend(
+                        self._map_label(self.sentiment_pipeline.postprocess({'logits': logits[j:j + 1]}))
+                        for j in range(len(chunk))
+                    )
+                
+                ordered = [None] * len(results)
+                for j, i in enumerate(order):
+                    ordered[i] = results[j]
+                return ordered
             except Exception as e:
                 logger.error(f"Batch analysis failed: {e}")
                 # Fallback to individual processing if batch fails
@@ -153,12 +614,159 @@ class SentimentAnalyzer:
                         results.append({
                             'sentiment_label': 'neutral',
                             'confidence_score': 0.0,
-                            'model_name': self.model_name
+                            'model_name': self.model_name,
+                            'fallback': True
                         })
                 return results
         else:
-            tasks = [self.analyze_sentiment(text) for text in texts]
-            return await asyncio.gather(*tasks, return_exceptions=True)
+            # One prompt per EXTERNAL_BATCH_SIZE texts instead of one per text
+            chunks = [texts[i:i + EXTERNAL_BATCH_SIZE] for i in range(0, len(texts), EXTERNAL_BATCH_SIZE)]
+            chunk_results = await asyncio.gather(*(self._external_sentiment_chunk(chunk) for chunk in chunks))
+            return [result for results in chunk_results for result in results]
+    
+    async def _external_sentiment_batch(self, texts: List[str]) -> List:
+        """
+        run_batch for the external micro-batcher: one numbered prompt for
+        several texts, one request per text if that fails (or for one text).
+        """
+        if len(texts) > 1:
+            try:
+                return await self._batch_external_sentiment(texts)
+            except Exception as e:
+                logger.warning(f"Batched external analysis failed, retrying per text: {e}")
+        
+        tasks = [self._external_sentiment(text) for text in texts]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _external_sentiment_chunk(self, texts: List[str]) -> List:
+        if all(text and text.strip() for text in texts):
+            try:
+                return await self._batch_external_sentiment([text[:2000] for text in texts])
+            except Exception as e:
+                logger.warning(f"Batched external analysis failed, retrying per text: {e}")
+        
+        tasks = [self.analyze_sentiment(text) for text in texts]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def close(self):
+        """
+        Stop the local micro-batchers' consumers, or close the external
+        provider's connection pool.
+        """
+        if self.model_type == 'local':
+            await self._sentiment_batcher.close()
+            await self._emotion_batcher.close()
+        else:
+            await self._external_batcher.close()
+            await self.client.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    def _map_label(self, result: Dict) -> Dict:
+        """
+        Normalise one pipeline result ({'label': 'POSITIVE', 'score': ...})
+        to the sentiment dict returned by analyze_sentiment.
+        """
+        return {
+            'sentiment_label': normalize_sentiment_label(result['label']),
+            'confidence_score': float(result['score']),
+            'model_name': self.model_name
+        }
+    
+    async def _post_json(self, url: str, headers: Dict, payload: Dict) -> Dict:
+        """
+        POST an orjson-encoded body and return the orjson-decoded reply.
+        `headers` must already carry the JSON Content-Type.
+        """
+        response = await self.client.post(
+            url,
+            headers=headers,
+            content=orjson.dumps(payload)
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    async def _complete(self, prompt: str, max_tokens: int = 100) -> str:
+        """
+        Send one user prompt to the configured provider and return the
+        reply text. `max_tokens` only goes to Anthropic, which requires it.
+        """
+        if self.provider == 'groq':
+            data = await self._post_json(
+                "https://api.groq.com/openai/v1/chat/completions",
+                headers=self._bearer_headers,
+                payload={
+                    "model": self.external_model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.1
+                }
+            )
+        elif self.provider == 'openai':
+            data = await self._post_json(
+                "https://api.openai.com/v1/chat/completions",
+                headers=self._bearer_headers,
+                payload={
+                    "model": self.external_model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.1
+                }
+            )
+        else:
+            data = await self._post_json(
+                "https://api.anthropic.com/v1/messages",
+                headers=self._anthropic_headers,
+                payload={
+                    "model": self.external_model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": max_tokens
+                }
+            )
+        
+        if self.provider == 'anthropic':
+            content = data['content'][0]['text']
+        else:
+            content = data['choices'][0]['message']['content']
+        return content
+    
+    async def _stream_json_object(self, prompt: str) -> Dict:
+        """
+        Stream a chat completion (OpenAI-compatible SSE) and return the JSON
+        object in it as soon as it is complete. Leaving the stream early
+        closes it, so the provider stops generating whatever would follow.
+        """
+        content = ""
+        async with self.client.stream(
+            "POST",
+            STREAMING_CHAT_URLS[self.provider],
+            headers=self._bearer_headers,
+            content=orjson.dumps({
+                "model": self.external_model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.1,
+                "stream": True
+            })
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                
+                delta = orjson.loads(data)['choices'][0]['delta'].get('content') or ""
+                content += delta
+                if "}" in delta and "{" in content:
+                    try:
+                        return orjson.loads(content[content.index("{"):content.rindex("}") + 1])
+                    except orjson.JSONDecodeError:
+                        pass  # a "}" inside a string value, keep reading
+        
+        return orjson.loads(content.strip())
     
     @retry(
         stop=stop_after_attempt(3),
@@ -166,55 +774,15 @@ class SentimentAnalyzer:
         retry=retry_if_exception_type((httpx.RequestError, httpx.HTTPStatusError))
     )
     async def _external_sentiment(self, text: str) -> Dict:
-        prompt = f"""Analyze the sentiment of this text and respond ONLY with a JSON object (no markdown, no explanation):
-{{"sentiment_label": "positive" or "negative" or "neutral", "confidence_score": 0.0 to 1.0}}
-
-Text: {text}"""
+        prompt = SENTIMENT_PROMPT_PREFIX + text
         
         try:
-            if self.provider == 'groq':
-                response = await self.client.post(
-                    "https://api.groq.com/openai/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}"},
-                    json={
-                        "model": self.external_model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.1
-                    }
-                )
-            elif self.provider == 'openai':
-                response = await self.client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}"},
-                    json={
-                        "model": self.external_model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.1
-                    }
-                )
+            if self.provider in STREAMING_CHAT_URLS:
+                result = await self._stream_json_object(prompt)
             else:
-                response = await self.client.post(
-                    "https://api.anthropic.com/v1/messages",
-                    headers={
-                        "x-api-key": self.api_key,
-                        "anthropic-version": "2023-06-01"
-                    },
-                    json={
-                        "model": self.external_model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": 100
-                    }
-                )
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            if self.provider == 'anthropic':
-                content = data['content'][0]['text']
-            else:
-                content = data['choices'][0]['message']['content']
+                content = await self._complete(prompt)
+                result = orjson.loads(content.strip())
             
-            result = json.loads(content.strip())
             result['model_name'] = self.model_name
             return result
             
@@ -226,8 +794,38 @@ Text: {text}"""
             return {
                 'sentiment_label': 'neutral',
                 'confidence_score': 0.5,
+                'model_name': self.model_name,
+                'fallback': True
+            }
+    
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        retry=retry_if_exception_type((httpx.RequestError, httpx.HTTPStatusError))
+    )
+    async def _batch_external_sentiment(self, texts: List[str]) -> List[Dict]:
+        """
+        Classify several texts with one prompt; the model answers with a JSON
+        array in the same order. Raises if the reply does not line up.
+        """
+        # One line per text so the numbering stays unambiguous
+        numbered = "\n".join(f"{i}. {' '.join(text.split())}" for i, text in enumerate(texts, 1))
+        prompt = BATCH_SENTIMENT_PROMPT_PREFIX + numbered
+        
+        content = await self._complete(prompt, max_tokens=30 * len(texts))
+        
+        results = orjson.loads(content.strip())
+        if not isinstance(results, list) or len(results) != len(texts):
+            raise ValueError(f"Expected {len(texts)} results, got: {content[:200]}")
+        
+        return [
+            {
+                'sentiment_label': result['sentiment_label'],
+                'confidence_score': float(result['confidence_score']),
                 'model_name': self.model_name
             }
+            for result in results
+        ]
     
     @retry(
         stop=stop_after_attempt(3),
@@ -235,17 +833,14 @@ Text: {text}"""
         retry=retry_if_exception_type((httpx.RequestError, httpx.HTTPStatusError))
     )
     async def _external_emotion(self, text: str) -> Dict:
-        prompt = f"""Detect the primary emotion in this text. Respond ONLY with JSON:
-{{"emotion": "joy" or "sadness" or "anger" or "fear" or "surprise" or "neutral", "confidence_score": 0.0 to 1.0}}
-
-Text: {text}"""
+        prompt = EMOTION_PROMPT_PREFIX + text
         
         try:
             if self.provider == 'groq':
-                response = await self.client.post(
+                data = await self._post_json(
                     "https://api.groq.com/openai/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}"},
-                    json={
+                    headers=self._bearer_headers,
+                    payload={
                         "model": self.external_model,
                         "messages": [{"role": "user", "content": prompt}],
                         "temperature": 0.1
@@ -253,21 +848,19 @@ Text: {text}"""
                 )
             else:
                 # Simplification for brevity, assume similar structure
-                response = await self.client.post(
+                data = await self._post_json(
                     "https://api.openai.com/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}"},
-                    json={
+                    headers=self._bearer_headers,
+                    payload={
                         "model": self.external_model,
                         "messages": [{"role": "user", "content": prompt}],
                         "temperature": 0.1
                     }
                 )
 
-            response.raise_for_status()
-            data = response.json()
             content = data['choices'][0]['message']['content']
             
-            result = json.loads(content.strip())
+            result = orjson.loads(content.strip())
             result['model_name'] = self.model_name
             return result
         except Exception as e:
@@ -279,3 +872,12 @@ Text: {text}"""
                 'confidence_score': 0.5,
                 'model_name': self.model_name
             }
+
+
+@functools.lru_cache(maxsize=None)
+def get_analyzer(model_type: str = 'local') -> SentimentAnalyzer:
+    """
+    Process-wide analyzer per model_type, so model weights are loaded once
+    no matter how many callers ask for one.
+    """
+    return SentimentAnalyzer(model_type=model_type)
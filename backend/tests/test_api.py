@@ -83,6 +83,19 @@ async def test_aggregate_date_filtering(client: AsyncClient):
     response = await client.get(f"/api/sentiment/aggregate?period=day&start_date={start}")
     assert response.status_code == 200
 
+@pytest.mark.asyncio
+async def test_aggregate_rejects_too_many_buckets(client: AsyncClient):
+    # Two years of minute buckets
+    response = await client.get(
+        "/api/sentiment/aggregate?period=minute&start_date=2022-01-01T00:00:00&end_date=2024-01-01T00:00:00"
+    )
+    assert response.status_code == 400
+    # The same range is fine in day buckets
+    response = await client.get(
+        "/api/sentiment/aggregate?period=day&start_date=2022-01-01T00:00:00&end_date=2024-01-01T00:00:00"
+    )
+    assert response.status_code == 200
+
 # --- Distribution Endpoint ---
 @pytest.mark.asyncio
 async def test_distribution_structure(client: AsyncClient):
@@ -124,6 +137,14 @@ def test_websocket_connect():
         # Since logic loops, we might receive metrics immediately or after delay
         # Just creating connection is enough for this test
 
+def test_routes_are_unique():
+    routes = [
+        (route.path, method)
+        for route in app.routes
+        for method in getattr(route, "methods", None) or ["WS"]
+    ]
+    assert len(routes) == len(set(routes))
+
 @pytest.mark.asyncio
 async def test_get_alerts_structure(client: AsyncClient):
     response = await client.get("/api/alerts")
@@ -131,3 +152,122 @@ async def test_get_alerts_structure(client: AsyncClient):
     assert "alerts" in data
     assert "total" in data
     assert "limit" in data
+
+@pytest.mark.asyncio
+async def test_get_metrics_structure(client: AsyncClient):
+    response = await client.get("/api/metrics")
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data["totals"]) == {"posts", "analyses", "alerts"}
+    assert "sentiment_breakdown" in data["last_hour"]
+    assert isinstance(data["models"], list)
+
+@pytest.mark.asyncio
+async def test_broadcast_drops_failed_connection():
+    import asyncio
+    from unittest.mock import AsyncMock
+    from app.api.websocket import ConnectionManager
+
+    manager = ConnectionManager()
+    healthy, broken = AsyncMock(), AsyncMock()
+    broken.send_text.side_effect = RuntimeError("socket closed")
+    await manager.connect(healthy)
+    await manager.connect(broken)
+
+    await manager.broadcast({"type": "ping"})
+    await asyncio.sleep(0)
+
+    healthy.send_text.assert_awaited_with('{"type":"ping"}')
+    assert broken not in manager.active_connections
+    manager.disconnect(healthy)
+
+@pytest.mark.asyncio
+async def test_new_post_subscriber_relays_to_websockets(monkeypatch):
+    import asyncio
+    from unittest.mock import AsyncMock, MagicMock
+    from app.api import websocket
+
+    frame = b'{"type":"new_post","data":{"post_id":"p1","content":"hi","source":"reddit"}}'
+    relayed = asyncio.Event()
+    broadcast_payload = MagicMock(side_effect=lambda *args: relayed.set())
+    monkeypatch.setattr(websocket.manager, "broadcast_payload", broadcast_payload)
+
+    messages = iter([
+        {"type": "message", "channel": websocket.CHANNELS["negative"].encode(), "data": frame},
+    ])
+
+    async def get_message(**kwargs):
+        message = next(messages, None)
+        if message is None:
+            await asyncio.Event().wait()
+        return message
+
+    pubsub = MagicMock()
+    pubsub.__aenter__ = AsyncMock(return_value=pubsub)
+    pubsub.__aexit__ = AsyncMock(return_value=False)
+    pubsub.subscribe = AsyncMock()
+    pubsub.get_message = get_message
+    client = MagicMock()
+    client.pubsub.return_value = pubsub
+
+    task = asyncio.create_task(websocket.new_post_subscriber(client))
+    await asyncio.wait_for(relayed.wait(), timeout=1)
+    await asyncio.sleep(0)
+    task.cancel()
+
+    pubsub.subscribe.assert_awaited_once_with(*websocket.CHANNELS.values())
+    broadcast_payload.assert_called_once_with(frame.decode(), "negative")
+    # Cache invalidation is the worker's job, once per saved batch
+    client.scan_iter.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_new_post_subscriber_pings_idle_clients(monkeypatch):
+    import asyncio
+    from unittest.mock import AsyncMock, MagicMock
+    from app.api import websocket
+
+    pinged = asyncio.Event()
+    broadcast_payload = MagicMock(side_effect=lambda *args: pinged.set())
+    monkeypatch.setattr(websocket.manager, "broadcast_payload", broadcast_payload)
+
+    pubsub = MagicMock()
+    pubsub.__aenter__ = AsyncMock(return_value=pubsub)
+    pubsub.__aexit__ = AsyncMock(return_value=False)
+    pubsub.subscribe = AsyncMock()
+    async def get_message(**kwargs):
+        await asyncio.sleep(0)  # nothing published within the timeout
+        return None
+
+    pubsub.get_message = AsyncMock(side_effect=get_message)
+    client = MagicMock()
+    client.pubsub.return_value = pubsub
+
+    task = asyncio.create_task(websocket.new_post_subscriber(client))
+    await asyncio.wait_for(pinged.wait(), timeout=1)
+    task.cancel()
+
+    pubsub.get_message.assert_awaited_with(
+        ignore_subscribe_messages=True, timeout=websocket.HEARTBEAT_SECONDS
+    )
+    broadcast_payload.assert_called_with('{"type":"ping"}')
+
+@pytest.mark.asyncio
+async def test_broadcast_respects_channel_subscriptions():
+    import asyncio
+    from unittest.mock import AsyncMock
+    from app.api.websocket import ConnectionManager
+
+    manager = ConnectionManager()
+    everything, alerts_only = AsyncMock(), AsyncMock()
+    await manager.connect(everything)
+    await manager.connect(alerts_only, ["alerts"])
+
+    await manager.broadcast({"type": "new_post"}, "neutral")
+    await manager.broadcast({"type": "alert"}, "alerts")
+    await asyncio.sleep(0)
+
+    assert everything.send_text.await_count == 2
+    alerts_only.send_text.assert_awaited_once_with('{"type":"alert"}')
+    manager.disconnect(everything)
+    manager.disconnect(alerts_only)
+    assert not any(manager.subscribers.values())
@@ -1,26 +1,25 @@
 import pytest
+import asyncio
 import datetime
-from sqlalchemy import text
+from unittest.mock import AsyncMock
 from httpx import AsyncClient
+from sqlalchemy import text
 
 @pytest.mark.asyncio
-async def test_e2e_full_flow_comprehensive(client: AsyncClient, db_session):
+async def test_e2e_full_flow_comprehensive(client: AsyncClient, seed_posts):
     """
     Comprehensive end-to-end test: 
     Insert data → Verify all endpoints → Check data consistency
     """
     # 1. Insert test data (simulate worker behavior)
-    pid = f"e2e_{int(datetime.datetime.utcnow().timestamp())}"
-    await db_session.execute(text("""
-        INSERT INTO social_media_posts (post_id, source, content, author, created_at, ingested_at)
-        VALUES (:pid, 'test_platform', 'I love this test!', 'test_user', NOW(), NOW())
-    """), {'pid': pid})
-    
-    await db_session.execute(text("""
-        INSERT INTO sentiment_analysis (post_id, model_name, sentiment_label, confidence_score, emotion, analyzed_at)
-        VALUES (:pid, 'test_model', 'positive', 0.95, 'joy', NOW())
-    """), {'pid': pid})
-    await db_session.commit()
+    now = datetime.datetime.utcnow()
+    pid = f"e2e_{int(now.timestamp())}"
+    await seed_posts(
+        [{'post_id': pid, 'source': 'test_platform', 'content': 'I love this test!',
+          'author': 'test_user', 'created_at': now, 'ingested_at': now}],
+        [{'post_id': pid, 'model_name': 'test_model', 'sentiment_label': 'positive',
+          'confidence_score': 0.95, 'emotion': 'joy', 'analyzed_at': now}],
+    )
     
     # 2. Test Posts API - verify structure and data
     resp_posts = await client.get("/api/posts?limit=100")
@@ -124,27 +123,29 @@ async def test_e2e_empty_data_handling(client: AsyncClient):
     assert first["positive_count"] == 0
 
 @pytest.mark.asyncio
-async def test_e2e_filtering_consistency(client: AsyncClient, db_session):
+async def test_e2e_filtering_consistency(client: AsyncClient, seed_posts):
     """
     Test that filtering works correctly across endpoints
     """
     # Insert posts with different sources
-    timestamp = int(datetime.datetime.utcnow().timestamp())
-    
-    await db_session.execute(text("""
-        INSERT INTO social_media_posts (post_id, source, content, author, created_at, ingested_at)
-        VALUES 
-            (:pid1, 'twitter', 'content1', 'user1', NOW(), NOW()),
-            (:pid2, 'reddit', 'content2', 'user2', NOW(), NOW())
-    """), {'pid1': f'test_twitter_{timestamp}', 'pid2': f'test_reddit_{timestamp}'})
-    
-    await db_session.execute(text("""
-        INSERT INTO sentiment_analysis (post_id, model_name, sentiment_label, confidence_score, emotion, analyzed_at)
-        VALUES 
-            (:pid1, 'test', 'positive', 0.9, 'joy', NOW()),
-            (:pid2, 'test', 'negative', 0.8, 'anger', NOW())
-    """), {'pid1': f'test_twitter_{timestamp}', 'pid2': f'test_reddit_{timestamp}'})
-    await db_session.commit()
+    now = datetime.datetime.utcnow()
+    timestamp = int(now.timestamp())
+    pid1, pid2 = f'test_twitter_{timestamp}', f'test_reddit_{timestamp}'
+    
+    await seed_posts(
+        [
+            {'post_id': pid1, 'source': 'twitter', 'content': 'content1', 'author': 'user1',
+             'created_at': now, 'ingested_at': now},
+            {'post_id': pid2, 'source': 'reddit', 'content': 'content2', 'author': 'user2',
+             'created_at': now, 'ingested_at': now},
+        ],
+        [
+            {'post_id': pid1, 'model_name': 'test', 'sentiment_label': 'positive',
+             'confidence_score': 0.9, 'emotion': 'joy', 'analyzed_at': now},
+            {'post_id': pid2, 'model_name': 'test', 'sentiment_label': 'negative',
+             'confidence_score': 0.8, 'emotion': 'anger', 'analyzed_at': now},
+        ],
+    )
     
     # Test source filtering
     resp = await client.get("/api/posts?source=twitter")
@@ -231,3 +232,71 @@ async def test_e2e_aggregate_periods(client: AsyncClient):
         data = resp.json()
         assert data["period"] == period
         assert "data" in data
+
+async def _wait_for_alert_checks(service):
+    while service._pending_check is not None and not service._pending_check.done():
+        await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_alerts_fire_once_per_window(db_session, seed_posts):
+    """
+    A sustained breach notified many times saves (and publishes) one alert
+    """
+    from app.core.database import AsyncSessionLocal
+    from app.services.alerting import AlertService, INSERT_NOTIFY_CHANNEL
+
+    now = datetime.datetime.utcnow()
+    pids = [f"alert_{int(now.timestamp())}_{i}" for i in range(12)]
+    await seed_posts(
+        [{'post_id': pid, 'source': 'test_platform', 'content': 'This is awful',
+          'author': 'test_user', 'created_at': now, 'ingested_at': now} for pid in pids],
+        [{'post_id': pid, 'model_name': 'test_model', 'sentiment_label': 'negative',
+          'confidence_score': 0.9, 'emotion': 'anger', 'analyzed_at': now} for pid in pids],
+    )
+
+    service = AlertService(AsyncSessionLocal)
+    service.debounce_seconds = 0.01
+    # Any negatives breach, whatever else the shared database holds
+    service.rules[0]["threshold"] = 0.0
+    service.publish_alert = AsyncMock()
+    # Notifications spread over several checks
+    for _ in range(5):
+        service._on_insert(None, 0, INSERT_NOTIFY_CHANNEL, "")
+        await asyncio.sleep(0.05)
+    await _wait_for_alert_checks(service)
+
+    saved = (await db_session.execute(text(
+        "SELECT COUNT(*) FROM sentiment_alerts WHERE alert_type = 'high_negative_ratio' "
+        "AND triggered_at > NOW() - make_interval(mins => :minutes)"
+    ), {"minutes": service.window_minutes})).scalar()
+    assert saved == 1
+    service.publish_alert.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_alert_insert_during_check_gets_rechecked():
+    """
+    An insert notified while a check runs is not dropped: one more check
+    follows the running one
+    """
+    from app.services.alerting import AlertService
+
+    service = AlertService(db_session_maker=None)
+    service.debounce_seconds = 0
+    release = asyncio.Event()
+    calls = []
+
+    async def check():
+        calls.append(1)
+        if len(calls) == 1:
+            await release.wait()
+    service.check_and_publish = check
+
+    service.schedule_check()
+    await asyncio.sleep(0.01)
+    # Both arrive during the first check
+    service.schedule_check()
+    service.schedule_check()
+    release.set()
+    await asyncio.sleep(0.01)
+    await _wait_for_alert_checks(service)
+    assert len(calls) == 2
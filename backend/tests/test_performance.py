@@ -5,6 +5,9 @@ import time
 from sqlalchemy import text
 from app.core.database import AsyncSessionLocal
 
+# Opens AsyncSessionLocal directly
+pytestmark = pytest.mark.usefixtures("db_connection")
+
 @pytest.mark.asyncio
 async def test_worker_throughput():
     """
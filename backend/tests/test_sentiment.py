@@ -1,18 +1,30 @@
 import pytest
+import pytest_asyncio
 import os
+import orjson
 from unittest.mock import MagicMock, patch, AsyncMock
 from app.services.sentiment_analyzer import SentimentAnalyzer
 
 # --- Fixtures ---
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_pipeline():
     with patch("app.services.sentiment_analyzer.pipeline") as mock:
         yield mock
 
-@pytest.fixture
-def analyzer(mock_pipeline):
+@pytest.fixture(scope="module")
+def shared_analyzer(mock_pipeline):
+    # Built once per module, like the process-wide get_analyzer()
     return SentimentAnalyzer(model_type='local')
 
+@pytest_asyncio.fixture
+async def analyzer(shared_analyzer, mock_pipeline):
+    # Undo per-test tweaks to the shared pipeline mocks
+    mock_pipeline.return_value.reset_mock(return_value=True, side_effect=True)
+    shared_analyzer.emotion_pipeline = shared_analyzer.sentiment_pipeline
+    shared_analyzer._sentiment_cache.clear()
+    yield shared_analyzer
+    await shared_analyzer.close()
+
 # --- Sentiment Tests (Local) ---
 @pytest.mark.asyncio
 async def test_sentiment_positive(analyzer, mock_pipeline):
@@ -47,7 +59,25 @@ async def test_sentiment_truncation(analyzer, mock_pipeline):
     await analyzer.analyze_sentiment(long_text)
     # Verify pipeline called with truncated text (2000 chars)
     args, _ = analyzer.sentiment_pipeline.call_args
-    assert len(args[0]) <= 2000
+    assert len(args[0][0]) <= 2000
+
+@pytest.mark.asyncio
+async def test_concurrent_sentiment_calls_share_one_pipeline_call(analyzer, mock_pipeline):
+    import asyncio
+    mock_pipeline.return_value.return_value = [
+        {'label': 'POSITIVE', 'score': 0.9},
+        {'label': 'NEGATIVE', 'score': 0.8}
+    ]
+    first, second = await asyncio.gather(
+        analyzer.analyze_sentiment("I love this!"),
+        analyzer.analyze_sentiment("I hate this.")
+    )
+    assert first['sentiment_label'] == 'positive'
+    assert second['sentiment_label'] == 'negative'
+    analyzer.sentiment_pipeline.assert_called_once()
+    args, kwargs = analyzer.sentiment_pipeline.call_args
+    assert args[0] == ["I love this!", "I hate this."]
+    assert kwargs['batch_size'] == 2
 
 @pytest.mark.asyncio
 async def test_sentiment_empty_error(analyzer):
@@ -122,6 +152,35 @@ async def test_emotion_short_text(analyzer):
     assert result['emotion'] == 'neutral'
     assert result['confidence_score'] == 1.0
 
+@pytest.mark.asyncio
+async def test_repeated_text_is_analyzed_once(analyzer, mock_pipeline):
+    import asyncio
+    mock_pipeline.return_value.return_value = [{'label': 'POSITIVE', 'score': 0.9}]
+    # Concurrent duplicates share the in-flight analysis, later ones hit the cache
+    results = await asyncio.gather(*(analyzer.analyze_sentiment("RT great game") for _ in range(3)))
+    results.append(await analyzer.analyze_sentiment("RT great game"))
+    assert all(r['sentiment_label'] == 'positive' for r in results)
+    analyzer.sentiment_pipeline.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_analyze_all_returns_sentiment_and_emotion(analyzer, mock_pipeline):
+    mock_pipeline.return_value.return_value = [{'label': 'joy', 'score': 0.7}]
+    sentiment, emotion = await analyzer.analyze_all("What a wonderful morning")
+    assert sentiment['sentiment_label'] == 'neutral'
+    assert emotion['emotion'] == 'joy'
+
+@pytest.mark.asyncio
+async def test_concurrent_analyze_all_runs_one_pass_per_model(analyzer, mock_pipeline):
+    import asyncio
+    # The worker analyzes a whole read batch this way
+    mock_pipeline.return_value.side_effect = lambda texts, **kwargs: [{'label': 'joy', 'score': 0.7}] * len(texts)
+    texts = ["What a wonderful morning", "Such a lovely evening", "Great match tonight"]
+    results = await asyncio.gather(*(analyzer.analyze_all(t) for t in texts))
+    assert [emotion['emotion'] for _, emotion in results] == ['joy'] * 3
+    # One sentiment and one emotion call (both models share this mock)
+    assert analyzer.sentiment_pipeline.call_count == 2
+    assert all(len(args[0]) == 3 for args, _ in analyzer.sentiment_pipeline.call_args_list)
+
 # --- Batch Tests ---
 @pytest.mark.asyncio
 async def test_batch_analyze_empty(analyzer):
@@ -132,23 +191,169 @@ async def test_batch_analyze_mixed(analyzer, mock_pipeline):
     # Mock return values for sequential calls if possible, or just fix return
     # Since mocked pipeline is same object, we can verify it's called X times
     # Batch analyze calls pipeline with list of texts, expects list of dicts
-    mock_pipeline.return_value.return_value = [
+    mock_pipeline.return_value.postprocess.side_effect = [
         {'label': 'POSITIVE', 'score': 0.9},
         {'label': 'NEGATIVE', 'score': 0.8}
     ]
     results = await analyzer.batch_analyze(["a", "b"])
     assert len(results) == 2
     assert results[0]['sentiment_label'] == 'positive'
+    # Both texts are tokenized together and go through a single forward pass
+    analyzer.sentiment_tokenizer.assert_called_once()
+    args, _ = analyzer.sentiment_tokenizer.call_args
+    assert args[0] == ["a", "b"]
+    analyzer.sentiment_pipeline.forward.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_batch_analyze_chunks_by_batch_size(analyzer, mock_pipeline):
+    mock_pipeline.return_value.postprocess.return_value = {'label': 'POSITIVE', 'score': 0.9}
+    batch_size, analyzer.batch_size = analyzer.batch_size, 2
+    try:
+        results = await analyzer.batch_analyze(["a", "b", "c"])
+    finally:
+        analyzer.batch_size = batch_size
+    assert len(results) == 3
+    chunks = [c.args[0] for c in analyzer.sentiment_tokenizer.call_args_list]
+    assert chunks == [["a", "b"], ["c"]]
+    assert analyzer.sentiment_pipeline.forward.call_count == 2
+
+@pytest.mark.asyncio
+async def test_batch_analyze_groups_texts_by_length(analyzer, mock_pipeline):
+    # Pass the texts through as "logits" so each result can be traced back
+    analyzer.sentiment_tokenizer.side_effect = lambda chunk, **kwargs: chunk
+    analyzer.sentiment_pipeline.forward.side_effect = lambda encoded: {'logits': encoded}
+    mock_pipeline.return_value.postprocess.side_effect = lambda outputs: {
+        'label': 'POSITIVE' if 'long' in outputs['logits'][0] else 'NEGATIVE', 'score': 0.9
+    }
+    batch_size, analyzer.batch_size = analyzer.batch_size, 2
+    try:
+        texts = ["a much longer post", "hi", "a long post", "yo"]
+        results = await analyzer.batch_analyze(texts)
+    finally:
+        analyzer.batch_size = batch_size
+    chunks = [c.args[0] for c in analyzer.sentiment_tokenizer.call_args_list]
+    assert chunks == [["hi", "yo"], ["a long post", "a much longer post"]]
+    labels = [r['sentiment_label'] for r in results]
+    assert labels == ['positive', 'negative', 'positive', 'negative']
 
 @pytest.mark.asyncio
 async def test_batch_error_handling(analyzer, mock_pipeline):
-    # Make pipeline raise exception
+    # Make the batched forward pass and the per-text fallback raise
+    analyzer.sentiment_pipeline.forward.side_effect = Exception("Boom")
     analyzer.sentiment_pipeline.side_effect = Exception("Boom")
     results = await analyzer.batch_analyze(["test"])
     assert results[0]['sentiment_label'] == 'neutral'
     # Implementation swallows error and returns neutral without error key
     assert results[0]['confidence_score'] == 0.0
 
+def test_onnx_flag_loads_onnx_pipelines(mock_pipeline):
+    with patch.dict(os.environ, {'SENTIMENT_ONNX': '1', 'SENTIMENT_QUANTIZE': '1'}), \
+            patch.object(SentimentAnalyzer, '_load_onnx_pipeline') as load_onnx, \
+            patch.object(SentimentAnalyzer, '_quantize_model') as quantize:
+        onnx_analyzer = SentimentAnalyzer(model_type='local')
+    assert onnx_analyzer.sentiment_pipeline is load_onnx.return_value
+    assert load_onnx.call_count == 2
+    quantize.assert_not_called()
+
+def test_quantize_onnx_model_loads_int8_graph(analyzer):
+    import sys
+    optimum = MagicMock()
+    modules = {
+        "optimum": optimum,
+        "optimum.onnxruntime": optimum.onnxruntime,
+        "optimum.onnxruntime.configuration": optimum.onnxruntime.configuration,
+    }
+    with patch.dict(sys.modules, modules):
+        model = analyzer._quantize_onnx_model("onnx-model", "/tmp/int8", {'provider': "CPUExecutionProvider"})
+    optimum.onnxruntime.configuration.AutoQuantizationConfig.avx512_vnni.assert_called_once_with(is_static=False, per_channel=False)
+    optimum.onnxruntime.ORTQuantizer.from_pretrained.assert_called_once_with("onnx-model")
+    ort_model = optimum.onnxruntime.ORTModelForSequenceClassification
+    ort_model.from_pretrained.assert_called_once_with(
+        "/tmp/int8", file_name="model_quantized.onnx", provider="CPUExecutionProvider"
+    )
+    assert model is ort_model.from_pretrained.return_value
+
+def test_gpu_device_loads_half_precision(mock_pipeline):
+    import sys
+    torch = MagicMock()
+    mock_pipeline.reset_mock()
+    with patch.dict(os.environ, {'SENTIMENT_DEVICE': '0'}), patch.dict(sys.modules, {"torch": torch}):
+        gpu_analyzer = SentimentAnalyzer(model_type='local')
+    assert gpu_analyzer.device == 0
+    _, kwargs = mock_pipeline.call_args
+    assert kwargs['device'] == 0
+    assert kwargs['torch_dtype'] is torch.float16
+
+def test_torch_num_threads_env(mock_pipeline):
+    import sys
+    torch = MagicMock()
+    with patch.dict(os.environ, {'TORCH_NUM_THREADS': '2'}), patch.dict(sys.modules, {"torch": torch}):
+        SentimentAnalyzer(model_type='local')
+    torch.set_num_threads.assert_called_once_with(2)
+    torch.set_num_interop_threads.assert_called_once_with(1)
+
+def test_quantize_model_swaps_linear_layers(analyzer):
+    import sys
+    torch = MagicMock()
+    local_pipeline = MagicMock()
+    eager = local_pipeline.model
+    with patch.dict(sys.modules, {"torch": torch}):
+        analyzer._quantize_model(local_pipeline)
+    torch.quantization.quantize_dynamic.assert_called_once_with(
+        eager, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    assert local_pipeline.model is torch.quantization.quantize_dynamic.return_value
+
+def test_bettertransformer_flag_converts_model(mock_pipeline):
+    with patch.dict(os.environ, {'SENTIMENT_BETTERTRANSFORMER': '1'}), \
+            patch.object(SentimentAnalyzer, '_to_bettertransformer') as convert:
+        bt_analyzer = SentimentAnalyzer(model_type='local')
+    convert.assert_any_call(bt_analyzer.sentiment_pipeline)
+    assert convert.call_count == 2
+
+def test_bettertransformer_falls_back_to_eager(analyzer):
+    local_pipeline = MagicMock()
+    eager = local_pipeline.model
+    eager.to_bettertransformer.side_effect = ImportError("optimum is not installed")
+    analyzer._to_bettertransformer(local_pipeline)
+    assert local_pipeline.model is eager
+
+def test_compile_model_wraps_and_warms_up(analyzer):
+    import sys
+    torch = MagicMock(__version__="2.1.1")
+    local_pipeline = MagicMock()
+    eager = local_pipeline.model
+    try:
+        with patch.dict(sys.modules, {"torch": torch}):
+            analyzer._compile_model(local_pipeline)
+        assert analyzer.pad_to_multiple_of == 32
+    finally:
+        analyzer.pad_to_multiple_of = None
+    torch.compile.assert_called_once_with(eager, mode="reduce-overhead", fullgraph=False, dynamic=True)
+    assert local_pipeline.model is torch.compile.return_value
+    local_pipeline.assert_called_once_with(["warmup"] * analyzer.batch_size, batch_size=analyzer.batch_size)
+
+def test_trace_model_falls_back_to_eager(analyzer):
+    import sys
+    torch = MagicMock()
+    torch.jit.trace.side_effect = RuntimeError("unsupported op")
+    local_pipeline = MagicMock()
+    eager = local_pipeline.model
+    with patch.dict(sys.modules, {"torch": torch}):
+        analyzer._trace_model(local_pipeline)
+    assert local_pipeline.model is eager
+
+@pytest.mark.asyncio
+async def test_micro_batcher_caps_batch_size():
+    import asyncio
+    from app.services.sentiment_analyzer import MicroBatcher
+    run_batch = MagicMock(side_effect=lambda texts: [t.upper() for t in texts])
+    batcher = MicroBatcher(run_batch, max_batch_size=2)
+    results = await asyncio.gather(*(batcher.submit(t) for t in ["a", "b", "c"]))
+    await batcher.close()
+    assert results == ["A", "B", "C"]
+    assert [c.args[0] for c in run_batch.call_args_list] == [["a", "b"], ["c"]]
+
 # --- External API Tests ---
 @pytest.mark.asyncio
 async def test_external_init_missing_key():
@@ -160,19 +365,33 @@ async def test_external_init_missing_key():
 async def test_external_sentiment_groq():
     with patch.dict(os.environ, {'EXTERNAL_LLM_API_KEY': 'fake', 'EXTERNAL_LLM_PROVIDER': 'groq'}):
         analyzer = SentimentAnalyzer(model_type='external')
-        # Mock the client.post method properly
+        # Streamed reply: the JSON object arrives in pieces, then more tokens
+        pieces = ['{"sentiment_label": "pos', 'itive", "confidence_score": 0.9}', ' Hope this helps!']
+        lines = [
+            "data: " + orjson.dumps({'choices': [{'delta': {'content': piece}}]}).decode()
+            for piece in pieces
+        ] + ["data: [DONE]"]
+        consumed = []
+        
+        async def aiter_lines():
+            for line in lines:
+                consumed.append(line)
+                yield line
+        
         mock_response = MagicMock()
-        mock_response.json.return_value = {
-            'choices': [{'message': {'content': '{"sentiment_label": "positive", "confidence_score": 0.9}'}}]
-        }
         mock_response.raise_for_status = MagicMock()
-        
-        # Use AsyncMock for the async post method
-        mock_post = AsyncMock(return_value=mock_response)
-        analyzer.client.post = mock_post
+        mock_response.aiter_lines = aiter_lines
+        stream = MagicMock()
+        stream.__aenter__ = AsyncMock(return_value=mock_response)
+        stream.__aexit__ = AsyncMock(return_value=False)
+        analyzer.client.stream = MagicMock(return_value=stream)
         
         result = await analyzer.analyze_sentiment("Good")
+        await analyzer.close()
         assert result['sentiment_label'] == 'positive'
+        assert result['confidence_score'] == 0.9
+        # Stopped reading as soon as the object was complete
+        assert len(consumed) == 2
 
 @pytest.mark.asyncio
 async def test_external_emotion_groq():
@@ -180,9 +399,9 @@ async def test_external_emotion_groq():
         analyzer = SentimentAnalyzer(model_type='external')
         
         mock_response = MagicMock()
-        mock_response.json.return_value = {
+        mock_response.content = orjson.dumps({
              'choices': [{'message': {'content': '{"emotion": "joy", "confidence_score": 0.9}'}}]
-        }
+        })
         mock_response.raise_for_status = MagicMock()
         
         mock_post = AsyncMock(return_value=mock_response)
@@ -192,11 +411,78 @@ async def test_external_emotion_groq():
         result = await analyzer.analyze_emotion("I am feeling so happy today!")
         assert result['emotion'] == 'joy'
 
+@pytest.mark.asyncio
+async def test_external_batch_uses_one_prompt():
+    with patch.dict(os.environ, {'EXTERNAL_LLM_API_KEY': 'fake', 'EXTERNAL_LLM_PROVIDER': 'groq'}):
+        analyzer = SentimentAnalyzer(model_type='external')
+        mock_response = MagicMock()
+        mock_response.content = orjson.dumps({
+            'choices': [{'message': {'content': orjson.dumps([
+                {"sentiment_label": "positive", "confidence_score": 0.9},
+                {"sentiment_label": "negative", "confidence_score": 0.8}
+            ]).decode()}}]
+        })
+        mock_response.raise_for_status = MagicMock()
+        analyzer.client.post = AsyncMock(return_value=mock_response)
+        
+        results = await analyzer.batch_analyze(["Good", "Bad"])
+        assert [r['sentiment_label'] for r in results] == ['positive', 'negative']
+        analyzer.client.post.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_external_concurrent_calls_share_one_request():
+    import asyncio
+    with patch.dict(os.environ, {'EXTERNAL_LLM_API_KEY': 'fake', 'EXTERNAL_LLM_PROVIDER': 'groq'}):
+        analyzer = SentimentAnalyzer(model_type='external')
+        mock_response = MagicMock()
+        mock_response.content = orjson.dumps({
+            'choices': [{'message': {'content': orjson.dumps([
+                {"sentiment_label": "positive", "confidence_score": 0.9},
+                {"sentiment_label": "negative", "confidence_score": 0.8}
+            ]).decode()}}]
+        })
+        mock_response.raise_for_status = MagicMock()
+        analyzer.client.post = AsyncMock(return_value=mock_response)
+        
+        first, second = await asyncio.gather(
+            analyzer.analyze_sentiment("Good"),
+            analyzer.analyze_sentiment("Bad")
+        )
+        await analyzer.close()
+        assert first['sentiment_label'] == 'positive'
+        assert second['sentiment_label'] == 'negative'
+        analyzer.client.post.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_external_close_releases_connections():
+    with patch.dict(os.environ, {'EXTERNAL_LLM_API_KEY': 'fake'}):
+        async with SentimentAnalyzer(model_type='external') as analyzer:
+            pass
+    assert analyzer.client.is_closed
+
+@pytest.mark.asyncio
+async def test_external_fallback_is_not_cached():
+    with patch.dict(os.environ, {'EXTERNAL_LLM_API_KEY': 'fake', 'EXTERNAL_LLM_PROVIDER': 'groq'}):
+        analyzer = SentimentAnalyzer(model_type='external')
+        # Malformed reply first, then a good one
+        analyzer._stream_json_object = AsyncMock(side_effect=[
+            ValueError("malformed JSON"),
+            {'sentiment_label': 'positive', 'confidence_score': 0.9}
+        ])
+        first = await analyzer.analyze_sentiment("Good")
+        second = await analyzer.analyze_sentiment("Good")
+        await analyzer.close()
+        assert first['sentiment_label'] == 'neutral'
+        assert first['fallback'] is True
+        assert second['sentiment_label'] == 'positive'
+        assert analyzer._stream_json_object.await_count == 2
+
 @pytest.mark.asyncio
 async def test_external_api_error_fallback():
     with patch.dict(os.environ, {'EXTERNAL_LLM_API_KEY': 'fake'}):
         analyzer = SentimentAnalyzer(model_type='external')
-        with patch.object(analyzer.client, 'post', side_effect=Exception("API Down")):
+        with patch.object(analyzer.client, 'stream', side_effect=Exception("API Down")):
             result = await analyzer.analyze_sentiment("test")
+            await analyzer.close()
             assert result['sentiment_label'] == 'neutral'
             assert result['confidence_score'] == 0.5
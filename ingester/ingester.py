@@ -1,15 +1,26 @@
 import os
 import time
-import json
 import random
+import itertools
 import asyncio
+import orjson
 from datetime import datetime, timezone
 import redis.asyncio as redis
+from redis.exceptions import ConnectionError as RedisConnectionError
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Each stream entry carries the whole post as one orjson blob in this field
+# (see process_message in worker/worker.py)
+POST_FIELD = "d"
+
+# Posts are generated and XADDed in pipelined batches of up to this many,
+# at most once per PUBLISH_INTERVAL_SECONDS, keeping the configured rate
+PUBLISH_BATCH_SIZE = 50
+PUBLISH_INTERVAL_SECONDS = 1.0
+
 class DataIngester:
     def __init__(self, redis_client, stream_name: str, posts_per_minute: int = 60):
         self.redis_client = redis_client
@@ -49,40 +60,57 @@ class DataIngester:
         
         self.sources = ["reddit", "twitter", "facebook", "instagram"]
         
-    def generate_post(self) -> dict:
-        sentiment_type = random.choices(
-            ["positive", "negative", "neutral"],
-            weights=[40, 30, 30]
-        )[0]
+        # Every template/product combination, formatted once. Sentiments keep
+        # their 40/30/30 split and each one's combinations are equally likely,
+        # so a post is a single weighted pick
+        self._contents = []
+        weights = []
+        for weight, templates in ((40, self.positive_templates),
+                                  (30, self.negative_templates),
+                                  (30, self.neutral_templates)):
+            contents = [t.format(product=p) for t in templates for p in self.products]
+            self._contents.extend(contents)
+            weights.extend([weight / len(contents)] * len(contents))
+        self._cum_weights = list(itertools.accumulate(weights))
         
-        product = random.choice(self.products)
-        
-        if sentiment_type == "positive":
-            content = random.choice(self.positive_templates).format(product=product)
-        elif sentiment_type == "negative":
-            content = random.choice(self.negative_templates).format(product=product)
-        else:
-            content = random.choice(self.neutral_templates).format(product=product)
+        self._random = random.Random()
+        self._last_post_us = 0
         
+    def generate_post(self) -> dict:
+        rng = self._random
+        # Microsecond ids, bumped when a batch produces several per tick
+        post_us = max(time.time_ns() // 1000, self._last_post_us + 1)
+        self._last_post_us = post_us
         return {
-            'post_id': f'post_{int(time.time() * 1000000)}',
-            'source': random.choice(self.sources),
-            'content': content,
-            'author': f'user{random.randint(1000, 9999)}',
+            'post_id': f'post_{post_us}',
+            'source': rng.choice(self.sources),
+            'content': rng.choices(self._contents, cum_weights=self._cum_weights)[0],
+            'author': f'user{rng.randint(1000, 9999)}',
             'created_at': datetime.now(timezone.utc).isoformat()
         }
     
     async def publish_post(self, post: dict) -> bool:
+        """Publish a single post through the batch path."""
+        return await self.publish_posts([post]) == 1
+    
+    async def publish_posts(self, posts: list) -> int:
+        """
+        XADD a batch of posts in one pipelined round trip; returns how many
+        were published.
+        """
         try:
-            message_id = await self.redis_client.xadd(self.stream_name, post)
-            logger.info(f"Published post {post['post_id']} with message_id {message_id}")
-            return True
-        except redis.exceptions.ConnectionError as e:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for post in posts:
+                pipe.xadd(self.stream_name, {POST_FIELD: orjson.dumps(post)})
+            message_ids = await pipe.execute()
+            logger.debug(f"Published {len(message_ids)} posts, last message_id {message_ids[-1]}")
+            return len(message_ids)
+        except RedisConnectionError as e:
             logger.error(f"Redis connection error: {e}")
-            return False
+            return 0
         except Exception as e:
-            logger.error(f"Error publishing post: {e}")
-            return False
+            logger.error(f"Error publishing posts: {e}")
+            return 0
     
     async def start(self, duration_seconds: int = None):
         logger.info(f"Starting ingester - {self.posts_per_minute} posts/minute")
@@ -95,15 +123,18 @@ class DataIngester:
                     logger.info(f"Duration limit reached. Published {post_count} posts")
                     break
                 
-                post = self.generate_post()
-                success = await self.publish_post(post)
+                # As many posts as fall due in one publish interval
+                count = int(PUBLISH_INTERVAL_SECONDS / self.sleep_interval)
+                count = max(1, min(PUBLISH_BATCH_SIZE, count))
+                posts = [self.generate_post() for _ in range(count)]
                 
-                if success:
-                    post_count += 1
-                    if post_count % 10 == 0:
+                published = await self.publish_posts(posts)
+                if published:
+                    previous, post_count = post_count, post_count + published
+                    if post_count // 10 > previous // 10:
                         logger.info(f"Published {post_count} posts")
                 
-                await asyncio.sleep(self.sleep_interval)
+                await asyncio.sleep(self.sleep_interval * count)
                 
         except KeyboardInterrupt:
             logger.info(f"Ingester stopped. Total posts published: {post_count}")
@@ -1,21 +1,121 @@
 import os
 import sys
-import time
 import asyncio
-import json
+import orjson
 import redis
+import uvloop
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
 import logging
-import httpx
+from typing import Optional
+
+
+def available_cpus() -> int:
+    """
+    CPUs this container may use: its cgroup CPU quota (v2, then v1) when
+    one is set, else the CPUs the process is allowed to run on.
+    """
+    quota_files = (
+        ('/sys/fs/cgroup/cpu.max', None),
+        ('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '/sys/fs/cgroup/cpu/cpu.cfs_period_us'),
+    )
+    for quota_file, period_file in quota_files:
+        try:
+            with open(quota_file) as f:
+                values = f.read().split()
+            if period_file:
+                with open(period_file) as f:
+                    values.append(f.read().strip())
+            quota, period = values[0], values[1]
+            if quota not in ('max', '-1'):
+                return max(1, int(quota) // int(period))
+        except (OSError, ValueError, IndexError):
+            continue
+    return len(os.sched_getaffinity(0))
+
+
+# torch/OpenMP/MKL size their thread pools when first imported and often
+# see every host CPU (or just 1) inside a container; pin them to the
+# container's share before the analyzer imports torch. Explicit settings win.
+for thread_var in ('TORCH_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+    if not os.getenv(thread_var):
+        os.environ[thread_var] = str(available_cpus())
 
 sys.path.append('/app/backend')
-from services.sentiment_analyzer import SentimentAnalyzer
+from services.sentiment_analyzer import get_analyzer
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# One channel per sentiment class; every API process subscribes and fans
+# out to its own clients (see CHANNELS in backend/app/api/websocket.py)
+SENTIMENT_CHANNEL = "events:sentiment:{}"
+
+# Stream field holding the orjson-encoded post (see POST_FIELD in the
+# ingester); entries written field-per-key are still accepted
+POST_FIELD = "d"
+
+# Messages per read batch: after the first message arrives, the read is
+# topped up for at most READ_FILL_MS or until READ_COUNT messages are in
+READ_COUNT = int(os.getenv('WORKER_READ_COUNT', 128))
+READ_FILL_MS = int(os.getenv('WORKER_READ_FILL_MS', 100))
+
+# Fields every post must carry
+REQUIRED_FIELDS = frozenset(('post_id', 'source', 'content', 'author', 'created_at'))
+
+# Cached API responses built from sentiment data (CACHE_PREFIX in
+# backend/app/core/cache.py); stale once a batch is saved
+API_CACHE_PATTERN = "api:sentiment:*"
+
+# Publishes allowed in flight at once; past this the oldest is cancelled
+MAX_PENDING_BROADCASTS = 1000
+
+# A post and its analysis in one statement; the sentiment row is fed by the
+# post insert's RETURNING. Executed once per read batch with a list of
+# parameter sets (executemany)
+INSERT_POST_WITH_SENTIMENT = text("""
+    WITH post AS (
+        INSERT INTO social_media_posts (post_id, source, content, author, created_at, ingested_at)
+        VALUES (:post_id, :source, :content, :author, :created_at, NOW())
+        ON CONFLICT (post_id) DO UPDATE SET ingested_at = NOW()
+        RETURNING post_id
+    )
+    INSERT INTO sentiment_analysis (
+        post_id, model_name, sentiment_label, 
+        confidence_score, emotion, analyzed_at
+    )
+    SELECT post.post_id, :model_name, :sentiment_label, 
+           :confidence_score, :emotion, NOW()
+    FROM post
+""")
+
+# Batches of at least this many rows are written with COPY instead
+COPY_MIN_ROWS = int(os.getenv('WORKER_COPY_MIN_ROWS', 32))
+
+POST_COLUMNS = ('post_id', 'source', 'content', 'author', 'created_at')
+SENTIMENT_COLUMNS = ('post_id', 'model_name', 'sentiment_label', 'confidence_score', 'emotion')
+
+# COPY has no ON CONFLICT, so posts are copied into a per-connection
+# staging table (emptied on commit) and merged from there
+CREATE_POSTS_STAGE = text("""
+    CREATE TEMP TABLE IF NOT EXISTS posts_stage (
+        post_id VARCHAR(255),
+        source VARCHAR(50),
+        content TEXT,
+        author VARCHAR(255),
+        created_at TIMESTAMP
+    ) ON COMMIT DELETE ROWS
+""")
+
+MERGE_POSTS_STAGE = text("""
+    INSERT INTO social_media_posts (post_id, source, content, author, created_at, ingested_at)
+    SELECT DISTINCT ON (post_id) post_id, source, content, author, created_at, NOW()
+    FROM posts_stage
+    ON CONFLICT (post_id) DO UPDATE SET ingested_at = NOW()
+""")
+
 
 # ADD before class definition (line 18):
 shutdown_event = asyncio.Event()
@@ -42,10 +142,10 @@ class SentimentWorker:
             expire_on_commit=False
         )
         
-        self.local_analyzer = SentimentAnalyzer(model_type='local')
+        self.local_analyzer = get_analyzer('local')
         
         try:
-            self.external_analyzer = SentimentAnalyzer(model_type='external')
+            self.external_analyzer = get_analyzer('external')
         except ValueError:
             logger.warning("No external LLM API key - using local only")
             self.external_analyzer = None
@@ -53,11 +153,16 @@ class SentimentWorker:
         self.processed_count = 0
         self.error_count = 0
         
-        self._create_consumer_group()
+        # New-post frames per channel, published once per read batch
+        self._outbox = {}
+        # In-flight publish tasks, oldest first (dict keeps insertion order)
+        self._broadcasts = {}
+        # Message ids to XACK, acknowledged once per read batch
+        self._acks = []
     
-    def _create_consumer_group(self):
+    async def _create_consumer_group(self):
         try:
-            self.redis_client.xgroup_create(
+            await self.redis_client.xgroup_create(
                 self.stream_name,
                 self.consumer_group,
                 id='0',
@@ -70,13 +175,15 @@ class SentimentWorker:
             else:
                 raise
     
-    async def process_message(self, message_id: str, message_data: dict) -> bool:
+    async def process_message(self, message_id: str, message_data: dict) -> Optional[dict]:
         try:
-            required_fields = ['post_id', 'source', 'content', 'author', 'created_at']
-            if not all(field in message_data for field in required_fields):
+            if POST_FIELD in message_data:
+                message_data = orjson.loads(message_data[POST_FIELD])
+            
+            if not REQUIRED_FIELDS.issubset(message_data):
                 logger.warning(f"Invalid message data: {message_data}")
-                self.redis_client.xack(self.stream_name, self.consumer_group, message_id)
-                return False
+                self._acks.append(message_id)
+                return None
             
             # Parse ISO timestamp to datetime object for PostgreSQL
             # Remove timezone info to match TIMESTAMP WITHOUT TIME ZONE column
@@ -89,8 +196,7 @@ class SentimentWorker:
             # Use LOCAL models ONLY for reliable processing
             # External API is unreliable and causes processing failures
             try:
-                sentiment_result = await self.local_analyzer.analyze_sentiment(content)
-                emotion_result = await self.local_analyzer.analyze_emotion(content)
+                sentiment_result, emotion_result = await self.local_analyzer.analyze_all(content)
             except Exception as e:
                 logger.error(f"Analysis failed for {message_data['post_id']}: {e}")
                 # Use neutral fallback if even local model fails
@@ -105,106 +211,272 @@ class SentimentWorker:
                     'model_name': 'fallback'
                 }
             
-            async with self.async_session() as session:
-                await session.execute(
-                    text("""
-                        INSERT INTO social_media_posts (post_id, source, content, author, created_at, ingested_at)
-                        VALUES (:post_id, :source, :content, :author, :created_at, NOW())
-                        ON CONFLICT (post_id) DO UPDATE SET ingested_at = NOW()
-                    """),
-                    {
+            return {
+                'message_id': message_id,
+                'post': {
+                    'post_id': message_data['post_id'],
+                    'source': message_data['source'],
+                    'content': message_data['content'],
+                    'author': message_data['author'],
+                    'created_at': created_at_dt  # Use parsed datetime
+                },
+                'sentiment': {
+                    'post_id': message_data['post_id'],
+                    'model_name': sentiment_result['model_name'],
+                    'sentiment_label': sentiment_result['sentiment_label'],
+                    'confidence_score': sentiment_result['confidence_score'],
+                    'emotion': emotion_result['emotion']
+                },
+                'frame': {
+                    'type': 'new_post',
+                    'data': {
                         'post_id': message_data['post_id'],
+                        'content': message_data['content'][:100],
                         'source': message_data['source'],
-                        'content': message_data['content'],
-                        'author': message_data['author'],
-                        'created_at': created_at_dt  # Use parsed datetime
-                    }
-                )
-                
-                await session.execute(
-                    text("""
-                        INSERT INTO sentiment_analysis (
-                            post_id, model_name, sentiment_label, 
-                            confidence_score, emotion, analyzed_at
-                        )
-                        VALUES (:post_id, :model_name, :sentiment_label, 
-                                :confidence_score, :emotion, NOW())
-                    """),
-                    {
-                        'post_id': message_data['post_id'],
-                        'model_name': sentiment_result['model_name'],
                         'sentiment_label': sentiment_result['sentiment_label'],
                         'confidence_score': sentiment_result['confidence_score'],
-                        'emotion': emotion_result['emotion']
+                        'emotion': emotion_result['emotion'],
+                        'timestamp': dt.utcnow()  # orjson emits ISO-8601
                     }
-                )
-                
-                await session.commit()
+                }
+            }
             
-            # Broadcast new post to WebSocket clients
-            try:
-                async with httpx.AsyncClient(timeout=2.0) as http_client:
-                    await http_client.post(
-                        'http://backend:8000/api/internal/broadcast',
-                        json={
-                            'post_id': message_data['post_id'],
-                            'content': message_data['content'],
-                            'source': message_data['source'],
-                            'sentiment_label': sentiment_result['sentiment_label'],
-                            'confidence_score': sentiment_result['confidence_score'],
-                            'emotion': emotion_result['emotion']
-                        }
+        except Exception as e:
+            logger.error(f"Error processing message {message_id}: {e}")
+            self.error_count += 1
+            return None
+    
+    async def _save_batch(self, results: list):
+        """
+        Persist one read batch in one transaction: a single executemany of
+        the combined insert, or COPY for large batches. If that fails, the
+        rows are retried one savepoint each, so a bad post only costs
+        itself. Saved posts are then queued for broadcast and ack; posts
+        that still fail stay unacked.
+        """
+        try:
+            # One pooled connection and one transaction (committed on exit)
+            # for the whole batch
+            async with self.async_session() as session, session.begin():
+                if len(results) >= COPY_MIN_ROWS:
+                    await self._copy_batch(session, results)
+                else:
+                    await session.execute(
+                        INSERT_POST_WITH_SENTIMENT,
+                        [{**r['post'], **r['sentiment']} for r in results]
                     )
-                    logger.debug(f"Broadcasted post {message_data['post_id']}")
-            except Exception as broadcast_error:
-                # Don't fail processing if broadcast fails
-                logger.warning(f"Broadcast failed: {broadcast_error}")
+            saved = results
+        except Exception as e:
+            logger.warning(f"Saving batch of {len(results)} messages failed, retrying one by one: {e}")
+            saved = await self._save_rows(results)
+        
+        for result in saved:
+            # Queue the broadcast to WebSocket clients (see _flush_broadcasts)
+            channel = SENTIMENT_CHANNEL.format(result['sentiment']['sentiment_label'])
+            self._outbox.setdefault(channel, []).append(result['frame'])
             
-            self.redis_client.xack(self.stream_name, self.consumer_group, message_id)
+            self._acks.append(result['message_id'])
             
             self.processed_count += 1
             if self.processed_count % 10 == 0:
                 logger.info(f"Processed {self.processed_count} messages")
-            
-            return True
-            
+    
+    async def _save_rows(self, results: list) -> list:
+        """
+        Save each result under its own savepoint in one transaction and
+        return the ones that were written.
+        """
+        saved = []
+        try:
+            async with self.async_session() as session, session.begin():
+                for result in results:
+                    try:
+                        async with session.begin_nested():
+                            await session.execute(
+                                INSERT_POST_WITH_SENTIMENT,
+                                {**result['post'], **result['sentiment']}
+                            )
+                        saved.append(result)
+                    except Exception as e:
+                        logger.error(f"Error saving message {result['message_id']}: {e}")
+                        self.error_count += 1
         except Exception as e:
-            logger.error(f"Error processing message {message_id}: {e}")
-            self.error_count += 1
-            return False
+            logger.error(f"Error saving batch of {len(results)} messages: {e}")
+            self.error_count += len(saved)
+            return []
+        return saved
     
-    async def run(self, batch_size: int = 10, block_ms: int = 5000):
+    async def _copy_batch(self, session, results: list):
+        """
+        Write a batch with asyncpg's COPY on the session's own connection,
+        inside its transaction.
+        """
+        # Through the session first, so the transaction has begun
+        await session.execute(CREATE_POSTS_STAGE)
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver = raw_connection.driver_connection
+        
+        await driver.copy_records_to_table(
+            'posts_stage',
+            records=[tuple(r['post'][c] for c in POST_COLUMNS) for r in results],
+            columns=POST_COLUMNS
+        )
+        await session.execute(MERGE_POSTS_STAGE)
+        # analyzed_at takes its NOW() default
+        await driver.copy_records_to_table(
+            'sentiment_analysis',
+            records=[tuple(r['sentiment'][c] for c in SENTIMENT_COLUMNS) for r in results],
+            columns=SENTIMENT_COLUMNS
+        )
+    
+    async def _flush_acks(self):
+        """
+        Acknowledge every message settled during one read batch with a
+        single XACK (it takes any number of ids), i.e. one round trip.
+        """
+        if not self._acks:
+            return
+        
+        acks, self._acks = self._acks, []
+        await self.redis_client.xack(self.stream_name, self.consumer_group, *acks)
+    
+    def _flush_broadcasts(self):
+        """
+        Publish the frames queued during one read batch in the background,
+        so a slow publish never holds up the next batch.
+        """
+        if not self._outbox:
+            return
+        
+        outbox, self._outbox = self._outbox, {}
+        task = asyncio.create_task(self._publish(outbox))
+        self._broadcasts[task] = None
+        task.add_done_callback(lambda t: self._broadcasts.pop(t, None))
+        
+        if len(self._broadcasts) > MAX_PENDING_BROADCASTS:
+            oldest = next(iter(self._broadcasts))
+            logger.warning("Too many broadcasts in flight, dropping the oldest")
+            oldest.cancel()
+    
+    async def _publish(self, outbox: dict):
+        """
+        A single message per channel (a {"type": "batch", "items": [...]}
+        frame when several posts share it), all in one pipelined round trip.
+        The API relays each frame to its clients as-is. The cached sentiment
+        responses are dropped first, once per batch, so clients refetching
+        on a frame see the new posts.
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            stale = [key async for key in self.redis_client.scan_iter(match=API_CACHE_PATTERN, count=500)]
+            if stale:
+                pipe.delete(*stale)
+            for channel, frames in outbox.items():
+                frame = frames[0] if len(frames) == 1 else {'type': 'batch', 'items': frames}
+                pipe.publish(channel, orjson.dumps(frame))
+            await pipe.execute()
+            logger.debug(f"Broadcasted {sum(map(len, outbox.values()))} posts")
+        except Exception as broadcast_error:
+            # Don't fail processing if broadcast fails
+            logger.warning(f"Broadcast failed: {broadcast_error}")
+    
+    def _read_batch(self, batch_size: int, block_ms: int) -> asyncio.Task:
+        return asyncio.create_task(self._fill_batch(batch_size, block_ms))
+    
+    async def _fill_batch(self, batch_size: int, block_ms: int) -> list:
+        """
+        Wait up to block_ms for new messages, then keep reading for at most
+        READ_FILL_MS until batch_size are in, so a trickle of posts still
+        forms one large batch. Returns XREADGROUP's [[stream, entries]] shape.
+        """
+        messages = await self.redis_client.xreadgroup(
+            self.consumer_group,
+            self.consumer_name,
+            {self.stream_name: '>'},
+            count=batch_size,
+            block=block_ms
+        )
+        if not messages:
+            return messages
+        
+        entries = [entry for _, stream_entries in messages for entry in stream_entries]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + READ_FILL_MS / 1000
+        while len(entries) < batch_size:
+            remaining_ms = int((deadline - loop.time()) * 1000)
+            if remaining_ms <= 0:
+                break
+            # Returns as soon as anything arrives (BLOCK 0 would wait forever)
+            more = await self.redis_client.xreadgroup(
+                self.consumer_group,
+                self.consumer_name,
+                {self.stream_name: '>'},
+                count=batch_size - len(entries),
+                block=remaining_ms
+            )
+            if not more:
+                break
+            entries.extend(entry for _, stream_entries in more for entry in stream_entries)
+        
+        return [[self.stream_name, entries]]
+    
+    async def run(self, batch_size: int = READ_COUNT, block_ms: int = 5000):
+        await self._create_consumer_group()
         logger.info(f"Worker {self.consumer_name} started")
         
+        # The next XREADGROUP is always in flight while the current batch
+        # is analyzed and saved, so the blocking read overlaps the work
+        pending_read = None
         try:
             while not shutdown_event.is_set():
                 try:
-                    messages = self.redis_client.xreadgroup(
-                        self.consumer_group,
-                        self.consumer_name,
-                        {self.stream_name: '>'},
-                        count=batch_size,
-                        block=block_ms
-                    )
+                    if pending_read is None:
+                        pending_read = self._read_batch(batch_size, block_ms)
+                    messages = await pending_read
+                    pending_read = self._read_batch(batch_size, block_ms)
                     
                     if not messages:
                         continue
                     
+                    # Every message is analyzed concurrently, so the analyzer's
+                    # micro-batchers run the read batch as full forward passes
+                    # (of up to their batch size) per model
                     tasks = []
                     for stream_name, stream_messages in messages:
                         for message_id, message_data in stream_messages:
                             tasks.append(self.process_message(message_id, message_data))
                     
                     if tasks:
-                        await asyncio.gather(*tasks, return_exceptions=True)
+                        results = await asyncio.gather(*tasks, return_exceptions=True)
+                        results = [r for r in results if isinstance(r, dict)]
+                        if results:
+                            await self._save_batch(results)
+                        await self._flush_acks()
+                        self._flush_broadcasts()
                         
                 except redis.exceptions.ConnectionError as e:
                     logger.error(f"Redis connection error: {e}")
+                    # The error may not have come from the read: a prefetch
+                    # left running would take messages nobody processes
+                    if pending_read is not None:
+                        pending_read.cancel()
+                    pending_read = None
                     await asyncio.sleep(5)
                     continue
                     
         except KeyboardInterrupt:
             logger.info(f"Worker stopped")
+        finally:
+            # A prefetched batch that was already delivered stays in the
+            # pending entries list, like any unacked message
+            if pending_read is not None:
+                pending_read.cancel()
+            if self._broadcasts:
+                await asyncio.gather(*self._broadcasts, return_exceptions=True)
+            await self.local_analyzer.close()
+            if self.external_analyzer is not None:
+                await self.external_analyzer.close()
 
 if __name__ == "__main__":
     REDIS_HOST = os.getenv("REDIS_HOST", "redis")
@@ -217,25 +489,40 @@ if __name__ == "__main__":
         logger.error("DATABASE_URL environment variable required")
         exit(1)
     
-    redis_client = redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        decode_responses=True
-    )
-    
-    for attempt in range(30):
+    async def main():
+        redis_client = Redis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            decode_responses=True
+        )
+        
+        for attempt in range(30):
+            try:
+                await redis_client.ping()
+                logger.info("Connected to Redis")
+                break
+            except:
+                logger.info(f"Waiting for Redis... (attempt {attempt + 1}/30)")
+                await asyncio.sleep(2)
+        else:
+            logger.error("Could not connect to Redis")
+            exit(1)
+        
+        # The insert statements are module-level text() constructs, so their
+        # compiled form is cached; asyncpg prepares them server-side once per
+        # connection and keeps them in this per-connection cache
+        db_engine = create_async_engine(
+            DATABASE_URL,
+            echo=False,
+            connect_args={'prepared_statement_cache_size': 200}
+        )
+        
+        worker = SentimentWorker(redis_client, db_engine, STREAM_NAME, CONSUMER_GROUP)
         try:
-            redis_client.ping()
-            logger.info("Connected to Redis")
-            break
-        except:
-            logger.info(f"Waiting for Redis... (attempt {attempt + 1}/30)")
-            time.sleep(2)
-    else:
-        logger.error("Could not connect to Redis")
-        exit(1)
-    
-    db_engine = create_async_engine(DATABASE_URL, echo=False)
+            await worker.run()
+        finally:
+            await redis_client.close()
+            await db_engine.dispose()
     
-    worker = SentimentWorker(redis_client, db_engine, STREAM_NAME, CONSUMER_GROUP)
-    asyncio.run(worker.run())
+    uvloop.install()
+    asyncio.run(main())